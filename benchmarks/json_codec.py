@@ -0,0 +1,51 @@
+"""
+JSON 后端基准测试
+
+对比标准库 json 与 orjson 在弹幕消息体上的解析/序列化速度
+
+用法:
+    python benchmarks/json_codec.py [消息体文件或录制文件]
+
+消息体文件为每行一条 JSON 消息体 (op 5 包体) 的文本文件, 也可以是 danmu --record 录制的文件; 不指定时使用合成的弹幕流量
+"""
+import json
+import sys
+from pathlib import Path
+from timeit import timeit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from open_bilibili_link.mockserver import synthetic_bodies, load_bodies  # noqa: E402
+
+
+def bench(name, func, bodies, number=5):
+    seconds = timeit(lambda: [func(b) for b in bodies], number=number)
+    rate = len(bodies) * number / seconds
+    print(f'{name:<24} {rate:>14,.0f} msg/s')
+    return rate
+
+
+def main():
+    bodies = load_bodies(sys.argv[1]) if len(sys.argv) > 1 else synthetic_bodies()
+    size = sum(map(len, bodies))
+    print(f'{len(bodies)} 条消息体, 共 {size / 1024:.1f} KiB')
+    base = bench('json.loads', json.loads, bodies)
+    objects = [json.loads(b) for b in bodies]
+    base_dumps = bench('json.dumps', lambda o: json.dumps(o, separators=(',', ':')).encode(), objects)
+    if orjson is None:
+        print('未安装 orjson, 跳过对比')
+        return
+    fast = bench('orjson.loads', orjson.loads, bodies)
+    views = [memoryview(b) for b in bodies]
+    bench('orjson.loads(memoryview)', orjson.loads, views)
+    fast_dumps = bench('orjson.dumps', orjson.dumps, objects)
+    print(f'解析加速 {fast / base:.2f}x, 序列化加速 {fast_dumps / base_dumps:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+弹幕吞吐基准测试
+
+在进程内启动本地测试服务器 (open_bilibili_link.mockserver), 通过 BilibiliLiveDanmuService.ws_connect 接收,
+统计消息吞吐 (msg/s)、分发延迟 p50/p99 (服务器发送 -> 订阅者回调) 和进程内存
+
+用法:
+    python benchmarks/throughput.py [--rate 0] [--duration 10] [--ver 2] [--batch 10] [--subscribers 1]
+"""
+import argparse
+import asyncio
+import resource
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from open_bilibili_link.codec import BACKEND, dumps  # noqa: E402
+from open_bilibili_link.mockserver import MockDanmuServer, load_bodies  # noqa: E402
+from open_bilibili_link.models import DanmuMessage  # noqa: E402
+from open_bilibili_link.network import ConnectorManager  # noqa: E402
+from open_bilibili_link.services import BilibiliLiveDanmuService  # noqa: E402
+
+PROBE_CMD = 'OBL_BENCH_PROBE'
+PROBE_TYPE = 'probe'
+ROOMID = 1
+
+
+class ProbeServer(MockDanmuServer):
+    """
+    每隔 probe_every 条消息插入一条带发送时间的探针消息
+    """
+
+    def __init__(self, *args, probe_every=50, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.probe_every = probe_every
+
+    def next_body(self, index: int) -> bytes:
+        if index % self.probe_every == 0:
+            return dumps({'cmd': PROBE_CMD, 'ts': perf_counter()})
+        return super().next_body(index)
+
+
+class Stats:
+    def __init__(self):
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.latencies = []
+
+    async def on_danmu(self, danmu: DanmuMessage):
+        if danmu.msg_type == BilibiliLiveDanmuService.TYPE_OTHER and isinstance(danmu.content, bytes):
+            # 非 op 5 数据包 (如加入房间回复), 不计入吞吐
+            return
+        now = perf_counter()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.count += 1
+        if danmu.msg_type == PROBE_TYPE:
+            self.latencies.append(now - danmu.content)
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def rss_mib():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return float('nan')
+
+
+async def run(args):
+    bodies = load_bodies(args.source) if args.source else None
+    server = ProbeServer(rate=args.rate, ver=args.ver, batch=args.batch, bodies=bodies)
+    await server.start()
+    service = BilibiliLiveDanmuService()
+    server.configure(service)
+    service.commands.register(PROBE_CMD, lambda j: DanmuMessage(PROBE_TYPE, j['ts']))
+    stats = [Stats() for _ in range(args.subscribers)]
+    for stat in stats:
+        service.register_callback(stat.on_danmu, external=False, roomid=ROOMID)
+    rss_before = rss_mib()
+    task = asyncio.ensure_future(service.ws_connect(ROOMID))
+    await asyncio.sleep(args.duration)
+    decoder = service.connections[ROOMID].decoder
+    await service.close()
+    task.cancel()
+    await ConnectorManager().close()
+    await server.stop()
+
+    print(f'JSON 后端: {BACKEND}  协议版本: {args.ver}  每帧消息: {args.batch}  '
+          f'限速: {args.rate or "无"}  订阅者: {args.subscribers}')
+    print(f'服务器发送: {server.sent} 条, 解码残留: {decoder.pending} 字节, 丢弃: {service.dropped} 条')
+    for i, stat in enumerate(stats):
+        elapsed = (stat.last - stat.first) if stat.count > 1 else float('nan')
+        print(f'[订阅者 {i}] 接收 {stat.count} 条  吞吐 {stat.count / elapsed:,.0f} msg/s  '
+              f'p50 {percentile(stat.latencies, 0.5) * 1000:.2f} ms  '
+              f'p99 {percentile(stat.latencies, 0.99) * 1000:.2f} ms')
+    print(f'RSS {rss_before:.1f} MiB -> {rss_mib():.1f} MiB, '
+          f'峰值 {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Danmu throughput benchmark')
+    parser.add_argument('--rate', type=float, default=0, help='messages per second, 0 = as fast as possible')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--ver', type=int, default=2, choices=[0, 1, 2, 3], help='protocol version')
+    parser.add_argument('--batch', type=int, default=10, help='messages per frame')
+    parser.add_argument('--subscribers', type=int, default=1)
+    parser.add_argument('--source', default=None, help='danmu recording, or file of JSON message bodies, one per line')
+    try:
+        asyncio.run(run(parser.parse_args()))
+    except ValueError as err:
+        parser.error(str(err))
+
+
+if __name__ == '__main__':
+    main()
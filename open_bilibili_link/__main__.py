@@ -10,7 +10,9 @@ import yaml
 from aiocache import caches
 
 from open_bilibili_link.cli import CliApp
+from open_bilibili_link.config import ConfigManager
 from open_bilibili_link.logger import LogManager
+from open_bilibili_link.network import ConnectorManager
 
 PID_FILE = Path('/') / 'tmp' / 'obl.pid'
 CACHE_CONFIG = Path(__file__).parent / 'configs' / 'cache.default.yaml'
@@ -44,6 +46,7 @@ def init():
 
 def main():
     parser, args = init()
+    ConnectorManager().configure(**ConfigManager().get('network', default={}))
     if not hasattr(args, 'command'):
         parser.print_help()
         sys.exit(0)
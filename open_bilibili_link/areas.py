@@ -0,0 +1,173 @@
+import os
+import pickle
+from bisect import bisect_left
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Set
+
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.models import LiveArea, LiveAreaResponse
+
+
+def _subsequence_span(term: str, query: str) -> Optional[int]:
+    """
+    query 按顺序出现在 term 中时返回匹配跨度 (越小越紧凑), 否则返回 None
+    """
+    start = pos = term.find(query[0])
+    if start < 0:
+        return None
+    for char in query[1:]:
+        pos = term.find(char, pos + 1)
+        if pos < 0:
+            return None
+    return pos - start + 1
+
+
+class AreaIndex:
+    """
+    直播分区索引
+
+    由分区树一次性建立 id/名称索引和搜索索引, 分区数据不变时可重复使用.
+    搜索词为分区名和拼音 (小写), 按 (词, 分区 id) 排序保存, 前缀匹配使用二分查找,
+    前缀结果不足时再做子序列模糊匹配 (如 yxlm 匹配 yingxionglianmeng)
+    """
+    # 索引格式版本, 结构变化时递增以丢弃旧的持久化文件
+    VERSION = 1
+    DEFAULT_LIMIT = 10
+
+    def __init__(self, categories: List[LiveAreaResponse.LiveAreaCategory]):
+        self.categories = categories
+        self.signature = self.make_signature(categories)
+        self.by_id: Dict[int, LiveArea] = {}
+        self.by_name: Dict[str, LiveArea] = {}
+        terms = set()
+        for category in categories:
+            for area in category.list:
+                self.by_id[area.id] = area
+                self.by_name.setdefault(area.name, area)
+                for term in (area.name, area.pinyin):
+                    if term:
+                        terms.add((term.lower(), area.id))
+        self.terms: List[Tuple[str, int]] = sorted(terms)
+        # 字符 -> 包含该字符的搜索词下标, 模糊匹配前先求交集缩小候选范围
+        self.postings: Dict[str, Set[int]] = {}
+        for i, (term, _) in enumerate(self.terms):
+            for char in set(term):
+                self.postings.setdefault(char, set()).add(i)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    @staticmethod
+    def make_signature(categories: List[LiveAreaResponse.LiveAreaCategory]) -> str:
+        """
+        分区数据摘要, 用于判断持久化的索引是否仍然有效
+        """
+        digest = sha1()
+        for category in categories:
+            for area in category.list:
+                digest.update(f'{category.id}\0{area.id}\0{area.name}\0{area.pinyin}\n'.encode())
+        return digest.hexdigest()
+
+    def get(self, areaid: int) -> Optional[LiveArea]:
+        """
+        按 id 查找分区
+        :param areaid: 分区 id
+        :type areaid: int
+        :rtype: Optional[LiveArea]
+        """
+        return self.by_id.get(areaid)
+
+    def find(self, name: str) -> Optional[LiveArea]:
+        """
+        按名称精确查找分区, 重名时返回第一个
+        :param name: 分区名
+        :type name: str
+        :rtype: Optional[LiveArea]
+        """
+        return self.by_name.get(name)
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[LiveArea]:
+        """
+        搜索分区, 按 完全匹配 > 前缀匹配 > 子串匹配 > 子序列匹配 排序
+        :param query: 分区名或拼音, 不区分大小写, 忽略空格
+        :type query: str
+        :param limit: 最多返回条数
+        :type limit: int
+        :return: 分区列表
+        :rtype: List[LiveArea]
+        """
+        query = ''.join(query.lower().split())
+        if not query or limit <= 0:
+            return []
+        # 分区 id -> 排序键, 同一分区取名称和拼音中较好的一个
+        ranks: Dict[int, tuple] = {}
+
+        def rank(areaid: int, key: tuple):
+            if areaid not in ranks or key < ranks[areaid]:
+                ranks[areaid] = key
+
+        i = bisect_left(self.terms, (query,))
+        while i < len(self.terms) and self.terms[i][0].startswith(query):
+            term, areaid = self.terms[i]
+            rank(areaid, (0 if term == query else 1, len(term), term))
+            i += 1
+        if len(ranks) < limit:
+            for term, areaid in (self.terms[i] for i in self._candidates(query)):
+                if areaid in ranks and ranks[areaid][0] < 2:
+                    continue
+                pos = term.find(query)
+                if pos > 0:
+                    rank(areaid, (2, pos, len(term), term))
+                    continue
+                span = _subsequence_span(term, query)
+                if span is not None:
+                    rank(areaid, (3, span, len(term), term))
+        return [self.by_id[areaid] for areaid, _ in sorted(ranks.items(), key=lambda item: item[1])[:limit]]
+
+    def _candidates(self, query: str) -> Set[int]:
+        postings = [self.postings.get(char) for char in set(query)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def save(self, path: Path):
+        """
+        持久化索引
+        :param path: 索引文件
+        :type path: Path
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('wb') as f:
+            pickle.dump((self.VERSION, self), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, categories: List[LiveAreaResponse.LiveAreaCategory], path: Optional[Path] = None) -> 'AreaIndex':
+        """
+        读取与分区数据一致的持久化索引, 不存在或已过期时重新建立并保存
+        :param categories: 分区数据
+        :param path: 索引文件, 为 None 时不持久化
+        :rtype: AreaIndex
+        """
+        if path is None:
+            return cls(categories)
+        try:
+            with path.open('rb') as f:
+                version, index = pickle.load(f)
+            if version == cls.VERSION and index.signature == cls.make_signature(categories):
+                # 复用调用方的分区对象, 使接口缓存命中时可用 is 判断数据未变化
+                index.categories = categories
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            LogManager.instance().debug(f'[Area] 丢弃无法读取的分区索引 {err}')
+        index = cls(categories)
+        try:
+            index.save(path)
+        except OSError as err:
+            LogManager.instance().warning(f'[Area] 保存分区索引失败 {err}')
+        return index
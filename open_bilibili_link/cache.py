@@ -0,0 +1,250 @@
+import asyncio
+import os
+import pickle
+from functools import wraps
+from hashlib import sha1
+from pathlib import Path
+from time import time
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple, Any
+
+from aiocache import SimpleMemoryCache
+
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.utils import Singleton
+
+
+def _make_key(args, kwargs) -> Hashable:
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        # 参数不可哈希时退化为 repr
+        key = repr(key)
+    return key
+
+
+def single_flight(func: Callable):
+    """
+    合并并发请求装饰器
+
+    同一方法以相同参数并发调用时, 只发出一次请求, 所有调用者共享同一结果或异常;
+    请求完成后立即移除, 不做缓存 (缓存由外层 cached 负责)
+    :param func: 协程方法
+    :type func: Callable
+    :return:
+    """
+    inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def done(key, task: asyncio.Future):
+        if inflight.get(key) is task:
+            inflight.pop(key)
+        if not task.cancelled():
+            # 标记异常已读取, 避免所有调用者都取消时输出警告
+            task.exception()
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = _make_key(args, kwargs)
+        task = inflight.get(key)
+        if task is None:
+            task = inflight[key] = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda t: done(key, t))
+        # 单个调用者被取消时不影响其他调用者
+        return await asyncio.shield(task)
+
+    wrapper.inflight = inflight
+    return wrapper
+
+
+class ApiCache(metaclass=Singleton):
+    """
+    接口响应两级缓存
+
+    内存层为 aiocache SimpleMemoryCache (不序列化, 直接保存对象), 磁盘层为 directory 下按接口分目录的 pickle 文件,
+    条目保存写入时间, 由 api_cached 按接口各自的 ttl 判断是否新鲜; directory 为 None 时不使用磁盘层.
+    每个接口有一个代数, invalidate 时加一, 代数变化前发出的请求结果不会写入缓存
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        self.directory = directory
+        self.memory = SimpleMemoryCache()
+        # 接口 -> 内存层中的键
+        self.keys: Dict[str, Set[str]] = {}
+        # 接口 -> 代数
+        self.generations: Dict[str, int] = {}
+        # 正在后台刷新的键
+        self.refreshing: Set[str] = set()
+
+    def generation(self, endpoint: str) -> int:
+        return self.generations.get(endpoint, 0)
+
+    def _path(self, endpoint: str, key: str) -> Path:
+        return self.directory / endpoint / f'{sha1(key.encode()).hexdigest()}.pickle'
+
+    def _read(self, endpoint: str, key: str):
+        path = self._path(endpoint, key)
+        try:
+            with path.open('rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            # 文件损坏或模型结构已变化
+            LogManager.instance().debug(f'[Cache] 丢弃无法读取的缓存 {path.name}: {err}')
+            path.unlink(missing_ok=True)
+            return None
+
+    def _write(self, endpoint: str, key: str, entry):
+        path = self._path(endpoint, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def _remove(self, endpoint: str = None):
+        if self.directory is None or not self.directory.exists():
+            return
+        for path in self.directory.glob(f'{endpoint or "*"}/*.pickle'):
+            path.unlink(missing_ok=True)
+
+    async def get(self, endpoint: str, key: str, persist=True) -> Optional[Tuple[float, Any]]:
+        """
+        读取缓存条目
+        :param endpoint: 接口名
+        :param key: 缓存键
+        :param persist: 是否查找磁盘层
+        :return: (写入时间, 值) 或 None
+        """
+        entry = await self.memory.get(key)
+        if entry is None and persist and self.directory is not None:
+            generation = self.generation(endpoint)
+            entry = await asyncio.get_event_loop().run_in_executor(None, self._read, endpoint, key)
+            if entry is not None and generation == self.generation(endpoint):
+                await self._set_memory(endpoint, key, entry)
+        return entry
+
+    async def _set_memory(self, endpoint: str, key: str, entry):
+        await self.memory.set(key, entry)
+        self.keys.setdefault(endpoint, set()).add(key)
+
+    async def set(self, endpoint: str, key: str, value, persist=True, generation: int = None):
+        """
+        写入缓存条目
+        :param generation: 请求发出时的接口代数, 与当前代数不同时放弃写入
+        """
+        if generation is not None and generation != self.generation(endpoint):
+            return
+        entry = (time(), value)
+        await self._set_memory(endpoint, key, entry)
+        if persist and self.directory is not None:
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self._write, endpoint, key, entry)
+            except Exception as err:
+                LogManager.instance().warning(f'[Cache] 写入缓存失败 {err}')
+
+    async def invalidate(self, endpoint: str):
+        """
+        移除接口的全部缓存条目
+        :param endpoint: 接口名
+        :type endpoint: str
+        """
+        self.generations[endpoint] = self.generation(endpoint) + 1
+        for key in self.keys.pop(endpoint, ()):
+            await self.memory.delete(key)
+        self._remove(endpoint)
+        LogManager.instance().debug(f'[Cache] 已清除接口缓存 {endpoint}')
+
+    async def clear(self):
+        """
+        清空内存和磁盘缓存, 退出登录时调用
+        """
+        for endpoint in set(self.generations) | set(self.keys):
+            self.generations[endpoint] = self.generation(endpoint) + 1
+        self.keys.clear()
+        await self.memory.clear()
+        self._remove()
+
+
+def _endpoint(func: Callable, name: str = None) -> str:
+    qualname = func.__qualname__ if name is None else f'{func.__qualname__.rsplit(".", 1)[0]}.{name}'
+    return f'{func.__module__}.{qualname}'
+
+
+def api_cached(ttl: float, stale: float = 0, persist=True):
+    """
+    接口缓存装饰器
+
+    缓存未过期时直接返回; 过期但仍在 stale 时间窗口内时立即返回旧值并在后台刷新;
+    其余情况等待请求完成. 被装饰方法的第一个参数 (self) 不参与缓存键
+    :param ttl: 缓存有效期 (秒)
+    :type ttl: float
+    :param stale: 过期后仍可返回旧值的时长 (秒)
+    :type stale: float
+    :param persist: 是否写入磁盘, 含敏感信息 (如推流码) 的接口应设为 False
+    :type persist: bool
+    :return:
+    """
+
+    def decorator(func: Callable):
+        endpoint = _endpoint(func)
+
+        async def refresh(key, args, kwargs):
+            generation = ApiCache().generation(endpoint)
+            value = await func(*args, **kwargs)
+            await ApiCache().set(endpoint, key, value, persist, generation)
+            return value
+
+        async def background(key, args, kwargs):
+            try:
+                await refresh(key, args, kwargs)
+            except Exception as err:
+                LogManager.instance().warning(f'[Cache] 后台刷新 {endpoint} 失败 {err}')
+            finally:
+                ApiCache().refreshing.discard(key)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = f'{endpoint}{_make_key(args[1:], kwargs)!r}'
+            entry = await ApiCache().get(endpoint, key, persist)
+            if entry is not None:
+                stored_at, value = entry
+                age = time() - stored_at
+                if age < ttl:
+                    return value
+                if age < ttl + stale:
+                    if key not in ApiCache().refreshing:
+                        ApiCache().refreshing.add(key)
+                        asyncio.ensure_future(background(key, args, kwargs))
+                    return value
+            return await refresh(key, args, kwargs)
+
+        wrapper.endpoint = endpoint
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*names: str):
+    """
+    写接口装饰器, 调用成功后清除所依赖的读接口缓存
+    :param names: 同一类中被 api_cached 装饰的读接口方法名
+    :return:
+    """
+
+    def decorator(func: Callable):
+        endpoints = [_endpoint(func, name) for name in names]
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                # 请求失败时服务端状态未知, 同样清除
+                for endpoint in endpoints:
+                    await ApiCache().invalidate(endpoint)
+
+        wrapper.invalidates = endpoints
+        return wrapper
+
+    return decorator
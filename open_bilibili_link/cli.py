@@ -1,8 +1,12 @@
 import asyncio
 
-from open_bilibili_link.models import DanmuData
+from open_bilibili_link.areas import AreaIndex
+from open_bilibili_link.dispatch import OverflowPolicy
+from open_bilibili_link.models import DanmuMessage
+from open_bilibili_link.network import ConnectorManager
+from open_bilibili_link.recorder import RecordingError
 from open_bilibili_link.services import BilibiliLiveService, BilibiliServiceException, BilibiliLiveDanmuService
-from open_bilibili_link.utils import timed_input, save_cookie
+from open_bilibili_link.utils import timed_input
 from open_bilibili_link.widgets.components.danmu import DanmuPusher, DanmuParser
 
 
@@ -20,16 +24,16 @@ class CliApp(object):
     async def _cookie_login(self):
         if BilibiliLiveService().logged_in:
             self._error('当前已登录')
-            await BilibiliLiveService().session.close()
+            await BilibiliLiveService().close()
             return
         cookie = await timed_input('Cookie:\n')
-        save_cookie(cookie, BilibiliLiveService.COOKIE_FILE, '.live.bilibili.com')
+        await BilibiliLiveService().cookie_login(cookie)
         self._success('Cookie 登录成功')
 
     async def _account_login(self):
         if BilibiliLiveService().logged_in:
             self._error('当前已登录')
-            await BilibiliLiveService().session.close()
+            await BilibiliLiveService().close()
             return
         try:
             username = await timed_input('用户名: ')
@@ -38,16 +42,15 @@ class CliApp(object):
         except BilibiliServiceException as e:
             self._error(f'[{e.args[0]}] 登录失败，请尝试使用 Cookie 登录 [--login_type=cookie]')
 
-    def logout(self):
+    async def logout(self):
         if BilibiliLiveService().logged_in:
-            BilibiliLiveService().TOKEN_FILE.unlink(missing_ok=True)
-            BilibiliLiveService().COOKIE_FILE.unlink(missing_ok=True)
+            await BilibiliLiveService().logout()
             self._success('已退出登录')
 
     async def checkin(self):
         if not BilibiliLiveService().logged_in:
             self._error('当前未登录')
-            await BilibiliLiveService().session.close()
+            await BilibiliLiveService().close()
             return
         try:
             data = await BilibiliLiveService().checkin()
@@ -55,7 +58,37 @@ class CliApp(object):
         except BilibiliServiceException as e:
             self._error(f'[{e.args[1]}] {e.args[0]}')
 
-    def _danmu(self, danmu: DanmuData):
+    async def area(self, query: str = '', *, select: int = 0, limit: int = AreaIndex.DEFAULT_LIMIT):
+        index = await BilibiliLiveService().get_area_index()
+        if not query:
+            if not BilibiliLiveService().logged_in:
+                self._error('当前未登录')
+                return
+            area = index.get(await BilibiliLiveService().areaid)
+            self._info(f'当前分区 {area.parent_name}/{area.name} ({area.id})' if area else '当前分区未知')
+            return
+        areas = [index.get(int(query))] if query.isdigit() and index.get(int(query)) else index.search(query, limit)
+        if not areas:
+            self._error(f'未找到分区 {query}')
+            return
+        if not select:
+            for i, area in enumerate(areas, 1):
+                self._write_line(f'{area.parent_name}/{area.name} ({area.id})', prefix=f'[{i}]')
+            return
+        if not 0 < select <= len(areas):
+            self._error(f'select 取值必须为 1-{len(areas)}')
+            return
+        if not BilibiliLiveService().logged_in:
+            self._error('当前未登录')
+            return
+        area = areas[select - 1]
+        try:
+            await BilibiliLiveService().update_room(area_id=area.id)
+            self._success(f'已切换到分区 {area.parent_name}/{area.name}')
+        except BilibiliServiceException as e:
+            self._error(f'[{e.args[1]}] {e.args[0]}')
+
+    def _danmu(self, danmu: DanmuMessage):
         text = DanmuParser.parse(danmu)
         if text is not None:
             self._info(text)
@@ -64,7 +97,8 @@ class CliApp(object):
         self._info('正在关闭弹幕连接请耐心等待...')
         BilibiliLiveDanmuService().unregister_callback(self._danmu)
 
-    async def danmu(self, roomid: int = 0, *, output: str = 'stdout'):
+    async def danmu(self, roomid: int = 0, *, output: str = 'stdout', record: str = None, max_lines: int = 0,
+                    refresh_interval: float = DanmuPusher.DEFAULT_REFRESH_INTERVAL):
         if output not in ['stdout', 'file']:
             self._error('未知输出目标 output 取值必须为 stdout,file')
             return
@@ -74,27 +108,47 @@ class CliApp(object):
         roomid = room_data.room_id
         import signal
         signal.signal(signal.SIGINT, self._danmu_off)
+        danmu_pusher = None
         if output == 'stdout':
-            BilibiliLiveDanmuService().register_callback(self._danmu, external=False)
+            BilibiliLiveDanmuService().register_callback(self._danmu, external=False, roomid=roomid)
         elif output == 'file':
-            danmu_pusher = DanmuPusher(roomid)
-            self._danmu = danmu_pusher.append_danmu # noqa
-            BilibiliLiveDanmuService().register_callback(self._danmu, external=False)
-        danmus = await BilibiliLiveService().get_danmu_history(roomid)
-        for danmu in danmus:
+            danmu_pusher = DanmuPusher(roomid, max_lines=max_lines, refresh_interval=refresh_interval)
+            self._danmu = danmu_pusher.append_danmus # noqa
+            BilibiliLiveDanmuService().register_batch_callback(self._danmu, external=False, roomid=roomid)
+        try:
+            danmus = await BilibiliLiveService().get_danmu_history(roomid)
             if output == 'stdout':
-                self._write_line(f'{danmu.nickname}: {danmu.text}')
+                for danmu in danmus:
+                    self._write_line(f'{danmu.nickname}: {danmu.text}')
             elif output == 'file':
-                danmu_pusher.file.write(f'{danmu.nickname}: {danmu.text}\n')
-                danmu_pusher.file.flush()
-        await BilibiliLiveDanmuService().ws_connect(roomid)
+                danmu_pusher.append_lines([f'{danmu.nickname}: {danmu.text}\n' for danmu in danmus])
+            await BilibiliLiveDanmuService().ws_connect(roomid, record=record)
+        finally:
+            # 写入最后一次被限流的内容并取消待执行的定时写入
+            if danmu_pusher is not None:
+                danmu_pusher.close()
+
+    async def replay(self, path: str = None, *, speed: float = 1.0):
+        if path is None:
+            self._error('请指定录制文件')
+            return
+        BilibiliLiveDanmuService().register_callback(self._danmu, external=False, overflow=OverflowPolicy.block)
+        try:
+            frames = await BilibiliLiveDanmuService().replay(path, speed=speed)
+        except (OSError, RecordingError) as e:
+            self._error(f'回放失败 {e}')
+            return
+        finally:
+            BilibiliLiveDanmuService().unregister_callback(self._danmu)
+        self._success(f'回放完成, 共 {frames} 帧')
 
     def __del__(self):
         loop = asyncio.get_event_loop()
         if BilibiliLiveService().session and not BilibiliLiveService().session.closed:
-            loop.run_until_complete(BilibiliLiveService().session.close())
+            loop.run_until_complete(BilibiliLiveService().close())
         if BilibiliLiveDanmuService().session and not BilibiliLiveDanmuService().session.closed:
-            loop.run_until_complete(BilibiliLiveDanmuService().session.close())
+            loop.run_until_complete(BilibiliLiveDanmuService().close())
+        loop.run_until_complete(ConnectorManager().close())
 
     @classmethod
     def _info(cls, message):
@@ -0,0 +1,28 @@
+"""
+JSON 编解码后端, 导入时优先选择 orjson, 未安装时回退到标准库 json
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    # orjson 可直接解析 bytes/memoryview/str, 无需额外复制
+    loads = orjson.loads
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    BACKEND = 'json'
+
+    def loads(data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
@@ -0,0 +1,264 @@
+import asyncio
+import zlib
+from struct import Struct
+from typing import Iterator, Tuple, Dict, Callable, Optional, Set
+
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.models import DanmuMessage
+from open_bilibili_link.utils import Timer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 弹幕包头: 包长度 头长度 协议版本 操作类型 序列号
+HEADER = Struct('!IHHII')
+HEADER_SIZE = HEADER.size
+
+# 协议版本
+PROTOVER_RAW = 1
+PROTOVER_ZLIB = 2
+PROTOVER_BROTLI = 3
+
+
+def supported_protover(protover: int) -> int:
+    """
+    获取当前环境可用的协议版本, brotli 模块未安装时回退到 zlib
+    :param protover: 期望的协议版本
+    :type protover: int
+    :return: 可用的协议版本
+    :rtype: int
+    """
+    if protover not in (PROTOVER_RAW, PROTOVER_ZLIB, PROTOVER_BROTLI):
+        raise ValueError(f'unknown protover {protover}')
+    if protover == PROTOVER_BROTLI and brotli is None:
+        LogManager.instance().info('[WebSocket] 未安装 brotli 模块, 弹幕协议回退到 zlib')
+        return PROTOVER_ZLIB
+    return protover
+
+
+def encode_packet(body: bytes, op: int, ver: int = PROTOVER_RAW, seq: int = 1) -> bytes:
+    """
+    封装弹幕数据包
+    :param body: 包体
+    :type body: bytes
+    :param op: 操作类型
+    :type op: int
+    :param ver: 协议版本
+    :type ver: int
+    :param seq: 序列号
+    :type seq: int
+    :return: 数据包
+    :rtype: bytes
+    """
+    return HEADER.pack(HEADER_SIZE + len(body), HEADER_SIZE, ver, op, seq) + body
+
+
+def compress_packets(packets: bytes, ver: int) -> bytes:
+    """
+    将多个数据包压缩为一个 zlib/brotli 数据包, 与服务端下发格式一致
+    :param packets: 已封装的数据包
+    :type packets: bytes
+    :param ver: 协议版本, PROTOVER_ZLIB 或 PROTOVER_BROTLI
+    :type ver: int
+    :return: 压缩后的数据包
+    :rtype: bytes
+    """
+    if ver == PROTOVER_ZLIB:
+        return encode_packet(zlib.compress(packets), 5, ver)
+    if ver == PROTOVER_BROTLI:
+        if brotli is None:
+            raise RuntimeError('brotli module is not installed')
+        return encode_packet(brotli.compress(packets), 5, ver)
+    return packets
+
+
+class DanmuDecoder:
+    """
+    弹幕数据包增量解码器
+
+    基于 memoryview 和偏移量遍历数据包, 不对剩余缓冲区做切片复制;
+    跨 WebSocket 消息的半包会暂存, 在下一次 feed 时拼接继续解析
+    """
+
+    def __init__(self):
+        self._pending = b''
+
+    @property
+    def pending(self) -> int:
+        """
+        未解析完成的缓存字节数
+        """
+        return len(self._pending)
+
+    def reset(self):
+        self._pending = b''
+
+    def feed(self, data) -> Iterator[Tuple[int, memoryview]]:
+        """
+        输入一帧数据, 逐个产出完整数据包
+        :param data: WebSocket 二进制消息
+        :type data: bytes
+        :return: (操作类型, 包体视图) 迭代器, 包体视图仅在本次迭代内有效
+        """
+        if self._pending:
+            data = self._pending + data
+            self._pending = b''
+        view = memoryview(data)
+        offset = yield from self._walk(view)
+        if offset < len(view):
+            # 仅复制末尾的半包
+            self._pending = bytes(view[offset:])
+
+    def _walk(self, view: memoryview):
+        offset = 0
+        total = len(view)
+        while total - offset >= HEADER_SIZE:
+            packet_len, header_len, ver, op, _ = HEADER.unpack_from(view, offset)
+            if packet_len < HEADER_SIZE or header_len > packet_len:
+                # 数据包损坏, 丢弃剩余数据
+                return total
+            if total - offset < packet_len:
+                break
+            body = view[offset + header_len:offset + packet_len]
+            offset += packet_len
+            if ver == 0 or ver == 1:
+                yield op, body
+            elif ver == PROTOVER_ZLIB:
+                yield from self._walk_nested(zlib.decompress(body))
+            elif ver == PROTOVER_BROTLI:
+                if brotli is None:
+                    LogManager.instance().warning('[WebSocket] 未安装 brotli 模块, 已丢弃 brotli 数据包')
+                    continue
+                yield from self._walk_nested(brotli.decompress(bytes(body)))
+        return offset
+
+    def _walk_nested(self, data: bytes):
+        # 压缩包内的数据包总是完整的, 不需要暂存半包
+        yield from self._walk(memoryview(data))
+
+
+class HeartbeatScheduler:
+    """
+    弹幕心跳调度器
+
+    所有打开的弹幕连接共用一个定时器, 有连接时启动, 最后一个连接移除时停止
+    """
+
+    def __init__(self, interval: float, payload: bytes):
+        self.interval = interval
+        self.payload = payload
+        self.connections: Set = set()
+        self._timer: Optional[Timer] = None
+
+    @property
+    def running(self) -> bool:
+        return self._timer is not None
+
+    def add(self, connection):
+        """
+        :param connection: 弹幕连接, 需提供 ws 属性
+        """
+        self.connections.add(connection)
+        if self._timer is None:
+            self._timer = Timer(self.interval, self.beat)
+
+    def discard(self, connection):
+        self.connections.discard(connection)
+        if not self.connections:
+            self.cancel()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def beat(self):
+        LogManager.instance().debug('[WebSocket] 正在发送维持心跳包')
+        connections = [c for c in self.connections if c.ws is not None and not c.ws.closed]
+        results = await asyncio.gather(*(c.ws.send_bytes(self.payload) for c in connections),
+                                       return_exceptions=True)
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                LogManager.instance().warning(f'[WebSocket] 直播间 {connection.roomid} 心跳发送失败 {result}')
+
+
+class DanmuCommandRegistry:
+    """
+    弹幕命令处理器注册表
+
+    以 cmd 为键查找处理器, 处理器只提取自己需要的字段并返回消息;
+    未注册的命令只花费一次字典查找, 不会被分发
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Callable[[dict], Optional[DanmuMessage]]] = {}
+        self.fallback: Optional[Callable[[dict], Optional[DanmuMessage]]] = None
+
+    def register(self, cmd: str, handler: Callable[[dict], Optional[DanmuMessage]] = None):
+        """
+        注册命令处理器, 可作为装饰器使用
+        :param cmd: 命令名称, 如 DANMU_MSG
+        :type cmd: str
+        :param handler: 处理器, 接收原始 JSON 字典, 返回 DanmuMessage 或 None (丢弃)
+        :type handler: Callable[[dict], Optional[DanmuMessage]]
+        """
+        if handler is None:
+            def decorator(func):
+                self._handlers[cmd] = func
+                return func
+
+            return decorator
+        self._handlers[cmd] = handler
+        return handler
+
+    def unregister(self, cmd: str):
+        self._handlers.pop(cmd, None)
+
+    def __contains__(self, cmd):
+        return cmd in self._handlers
+
+    def dispatch(self, j: dict) -> Optional[DanmuMessage]:
+        cmd = j.get('cmd', '')
+        handler = self._handlers.get(cmd)
+        if handler is None and ':' in cmd:
+            # 新版弹幕命令带有后缀, 如 DANMU_MSG:4:0:2:2:2:0
+            handler = self._handlers.get(cmd.split(':', 1)[0])
+        if handler is None:
+            handler = self.fallback
+            if handler is None:
+                return None
+        return handler(j)
+
+
+COMMANDS = DanmuCommandRegistry()
+
+
+@COMMANDS.register('DANMU_MSG')
+def _danmaku(j: dict) -> DanmuMessage:
+    info = j.get('info') or ['', '', ['', '']]
+    return DanmuMessage('danmaku', info[1], name=info[2][1] or j.get('data', {}).get('uname', ''))
+
+
+@COMMANDS.register('SEND_GIFT')
+def _gift(j: dict) -> DanmuMessage:
+    return DanmuMessage('gift', {'cmd': j['cmd'], 'data': j.get('data')})
+
+
+@COMMANDS.register('WELCOME')
+def _enter(j: dict) -> DanmuMessage:
+    return DanmuMessage('enter', {'cmd': j['cmd'], 'data': j.get('data')})
+
+
+@COMMANDS.register('NOTICE_MSG')
+def _broadcast(j: dict) -> DanmuMessage:
+    return DanmuMessage('broadcast', j.get('msg_common', 'none'), type=j.get('msg_type', 0),
+                        roomid=j.get('real_roomid', 0), raw=j)
+
+
+def other(j: dict) -> DanmuMessage:
+    """
+    原样分发的处理器, 可设置为 COMMANDS.fallback 以接收所有未注册命令
+    """
+    return DanmuMessage('other', j)
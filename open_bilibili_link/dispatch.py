@@ -0,0 +1,177 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Optional
+
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.models import DanmuMessage
+
+
+class OverflowPolicy(Enum):
+    """
+    订阅队列溢出策略
+    """
+    drop_oldest = 'drop-oldest'
+    drop_newest = 'drop-newest'
+    block = 'block'
+
+
+class CallbackExecutor:
+    """
+    同步弹幕回调专用线程池
+
+    线程数有上限; 每个订阅者同一时间只有一个任务在执行, 保证回调按顺序执行
+    """
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, func: Callable, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='obl-danmu')
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class DanmuSubscriber:
+    """
+    弹幕订阅者
+
+    每个回调拥有独立的有界队列和工作协程, 慢回调不会阻塞 WebSocket 读取;
+    同步回调默认在 CallbackExecutor 中按顺序执行, threaded=False 时直接在事件循环线程执行 (如 Qt 组件)
+    """
+    DEFAULT_MAXSIZE = 1000
+
+    def __init__(self, callback: Callable, *, external=True, validate=False, maxsize: int = DEFAULT_MAXSIZE,
+                 overflow: OverflowPolicy = OverflowPolicy.drop_oldest, threaded=True,
+                 executor: CallbackExecutor = None):
+        self.callback = callback
+        self.external = external
+        self.validate = validate
+        self.overflow = OverflowPolicy(overflow)
+        self.threaded = threaded
+        self.executor = executor if executor is not None else CallbackExecutor(1)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        # 因队列溢出丢弃的消息数
+        self.dropped = 0
+        # 回调异常数及最近一次异常
+        self.errors = 0
+        self.last_error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Future] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._work())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def put(self, message: DanmuMessage):
+        """
+        投递消息, 队列已满时按溢出策略处理
+        :param message: 弹幕消息
+        :type message: DanmuMessage
+        """
+        self.start()
+        if self.overflow == OverflowPolicy.block:
+            await self.queue.put(message)
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow == OverflowPolicy.drop_newest:
+                return
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.queue.put_nowait(message)
+
+    async def join(self):
+        """
+        等待队列中的消息全部投递完成
+        """
+        if self._task is not None:
+            await self.queue.join()
+
+    async def deliver(self, message: DanmuMessage):
+        await self._invoke(message.validate() if self.validate else message)
+
+    async def _invoke(self, arg):
+        if asyncio.iscoroutinefunction(self.callback):
+            await self.callback(arg)
+        elif self.threaded:
+            await self.executor.run(self.callback, arg)
+        else:
+            self.callback(arg)
+
+    async def _work(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.deliver(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.errors += 1
+                self.last_error = err
+                LogManager.instance().exception(f'[WebSocket] 弹幕回调 {self.name} 执行异常: {err}')
+            finally:
+                self.queue.task_done()
+
+    @property
+    def name(self) -> str:
+        return getattr(self.callback, '__qualname__', repr(self.callback))
+
+
+class DanmuBatchSubscriber(DanmuSubscriber):
+    """
+    批量弹幕订阅者
+
+    在时间窗口内或达到数量上限时, 以列表形式一次性投递消息
+    """
+    DEFAULT_INTERVAL = 0.05
+    DEFAULT_BATCH_SIZE = 200
+
+    def __init__(self, callback: Callable, *, interval: float = DEFAULT_INTERVAL,
+                 batch_size: int = DEFAULT_BATCH_SIZE, **kwargs):
+        super().__init__(callback, **kwargs)
+        self.interval = interval
+        self.batch_size = batch_size
+        self._full = asyncio.Event()
+
+    async def put(self, message: DanmuMessage):
+        await super().put(message)
+        if self.queue.qsize() >= self.batch_size:
+            self._full.set()
+
+    async def _work(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.queue.qsize() + 1 < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if self.queue.qsize() < self.batch_size:
+                self._full.clear()
+            try:
+                await self._invoke([m.validate() for m in batch] if self.validate else batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.errors += 1
+                self.last_error = err
+                LogManager.instance().exception(f'[WebSocket] 弹幕回调 {self.name} 执行异常: {err}')
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from pathlib import Path
+from time import time
+from typing import Optional, Dict
+
+from aiohttp import ClientSession, ClientError
+
+from open_bilibili_link.cache import single_flight
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.utils import Singleton
+
+
+class ImageEntry:
+    """
+    磁盘缓存条目
+    """
+    __slots__ = ('file', 'size', 'etag', 'last_modified', 'checked')
+
+    def __init__(self, file: str, size: int, etag: str = None, last_modified: str = None, checked: float = 0):
+        self.file = file
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        # 最近一次从服务器确认的时间
+        self.checked = checked
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class ImageCache(metaclass=Singleton):
+    """
+    图片缓存 (头像, 背景, 关键帧)
+
+    磁盘层按 LRU 淘汰, 总大小不超过 max_bytes, 条目超过 ttl 后使用 ETag/Last-Modified 条件请求重新验证;
+    内存层保存最近使用的图片数据, 所有组件共享. 文件读写均在线程池中执行
+    """
+    INDEX_FILE = 'index.json'
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    DEFAULT_MEMORY_BYTES = 16 * 1024 * 1024
+    DEFAULT_TTL = 86400
+
+    def __init__(self, directory: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 memory_bytes: int = DEFAULT_MEMORY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        # url -> 条目, 按最近使用排序
+        self._entries: Optional[OrderedDict] = None
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_size = 0
+        # 并发的首次调用共享同一次索引加载
+        self._loading: Optional[asyncio.Future] = None
+        # 索引保存互斥, 避免多个线程同时写 index.tmp
+        self._index_lock = asyncio.Lock()
+
+    @property
+    def size(self) -> int:
+        return sum(e.size for e in (self._entries or {}).values())
+
+    @staticmethod
+    async def _run(func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _load_index(self) -> OrderedDict:
+        entries = OrderedDict()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index = self.directory / self.INDEX_FILE
+        try:
+            with index.open('r') as f:
+                for url, data in json.load(f).items():
+                    entries[url] = ImageEntry(**data)
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as err:
+            # 索引损坏时不清理文件, 同名文件会在重新下载时覆盖
+            LogManager.instance().warning(f'[Image] 图片缓存索引损坏, 已重建 {err}')
+            return OrderedDict()
+        # 清理索引外的文件 (旧版本缓存或未完成的写入)
+        known = {e.file for e in entries.values()} | {self.INDEX_FILE}
+        for path in self.directory.iterdir():
+            if path.is_file() and path.name not in known:
+                path.unlink(missing_ok=True)
+        return entries
+
+    def _save_index(self, data: Dict[str, dict]):
+        index = self.directory / self.INDEX_FILE
+        tmp = index.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(data, f)
+        os.replace(tmp, index)
+
+    def _read(self, file: str) -> bytes:
+        with (self.directory / file).open('rb') as f:
+            return f.read()
+
+    def _write(self, file: str, data: bytes):
+        path = self.directory / file
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _remember(self, url: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(url, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[url] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    async def _evict(self):
+        total = self.size
+        removed = []
+        while total > self.max_bytes and len(self._entries) > 1:
+            url, entry = self._entries.popitem(last=False)
+            total -= entry.size
+            removed.append(entry.file)
+            self._forget(url)
+        for file in removed:
+            await self._run((self.directory / file).unlink, True)
+
+    def _forget(self, url: str):
+        data = self._memory.pop(url, None)
+        if data is not None:
+            self._memory_size -= len(data)
+
+    async def _ensure_index(self):
+        if self._entries is not None:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._run(self._load_index))
+        try:
+            entries = await asyncio.shield(self._loading)
+        except Exception:
+            self._loading = None
+            raise
+        if self._entries is None:
+            self._entries = entries
+
+    async def _commit(self):
+        async with self._index_lock:
+            await self._evict()
+            # 在锁内取快照, 后保存的一定是较新的索引
+            data = {url: e.to_dict() for url, e in self._entries.items()}
+            try:
+                await self._run(self._save_index, data)
+            except OSError as err:
+                LogManager.instance().warning(f'[Image] 保存图片缓存索引失败 {err}')
+
+    @single_flight
+    async def get(self, session: ClientSession, url: str, ttl: float = DEFAULT_TTL) -> bytes:
+        """
+        获取图片数据
+        :param session: 网络会话
+        :type session: ClientSession
+        :param url: 图片地址
+        :type url: str
+        :param ttl: 超过该时长 (秒) 未确认的缓存需要重新验证
+        :type ttl: float
+        :return: 图片数据
+        :rtype: bytes
+        """
+        if self.directory is None:
+            async with session.get(url) as r:
+                return await r.read()
+        await self._ensure_index()
+        entry: Optional[ImageEntry] = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+            if time() - entry.checked < ttl:
+                data = self._memory.get(url)
+                if data is not None:
+                    self._memory.move_to_end(url)
+                    return data
+                try:
+                    data = await self._run(self._read, entry.file)
+                    self._remember(url, data)
+                    return data
+                except OSError:
+                    # 文件被外部删除, 重新下载
+                    self._entries.pop(url)
+                    entry = None
+        return await self._fetch(session, url, entry)
+
+    async def _fetch(self, session: ClientSession, url: str, entry: Optional[ImageEntry]) -> bytes:
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        try:
+            async with session.get(url, headers=headers) as r:
+                if r.status == 304 and entry is not None:
+                    data = self._memory.get(url) or await self._run(self._read, entry.file)
+                    entry.checked = time()
+                else:
+                    r.raise_for_status()
+                    data = await r.read()
+                    file = f'{sha1(url.encode()).hexdigest()}{Path(r.url.path).suffix[:8]}'
+                    await self._run(self._write, file, data)
+                    entry = ImageEntry(file, len(data), r.headers.get('ETag'), r.headers.get('Last-Modified'), time())
+        except (ClientError, asyncio.TimeoutError) as err:
+            if entry is None:
+                raise
+            LogManager.instance().warning(f'[Image] 图片验证失败, 使用缓存 {url}: {err}')
+            data = self._memory.get(url) or await self._run(self._read, entry.file)
+            self._remember(url, data)
+            return data
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        self._remember(url, data)
+        await self._commit()
+        return data
+
+    async def clear(self):
+        """
+        清空图片缓存
+        """
+        self._memory.clear()
+        self._memory_size = 0
+        if self.directory is None:
+            return
+        await self._ensure_index()
+        files = [e.file for e in self._entries.values()]
+        self._entries.clear()
+        for file in files:
+            await self._run((self.directory / file).unlink, True)
+        await self._commit()
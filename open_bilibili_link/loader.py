@@ -0,0 +1,64 @@
+import asyncio
+from time import perf_counter
+from typing import Awaitable, Dict, List
+
+from open_bilibili_link.logger import LogManager
+
+
+class SectionLoader:
+    """
+    并发加载器
+
+    fetch 立即发起相互独立的请求, 各请求以任务形式共享给多个区块; section 注册的区块各自等待所需数据,
+    数据到达后立即渲染, 不等待其他区块. 单个请求或区块失败只记录日志, 不影响其他区块
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = perf_counter()
+        # 请求/区块名 -> 自开始加载起的完成时间 (毫秒)
+        self.timings: Dict[str, float] = {}
+        self._sections: List[asyncio.Future] = []
+
+    async def _timed(self, name: str, aw: Awaitable):
+        try:
+            return await aw
+        finally:
+            self.timings[name] = (perf_counter() - self.started) * 1000
+
+    def fetch(self, name: str, aw: Awaitable) -> asyncio.Future:
+        """
+        立即发起请求
+        :param name: 请求名, 用于记录耗时
+        :param aw: 请求协程
+        :return: 可被多个区块等待的任务
+        :rtype: asyncio.Future
+        """
+        task = asyncio.ensure_future(self._timed(name, aw))
+        # 所有等待者都失败时异常已由区块记录, 这里只标记为已读取
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def section(self, name: str, aw: Awaitable):
+        """
+        注册渲染区块
+        :param name: 区块名
+        :param aw: 等待数据并渲染的协程
+        """
+        self._sections.append(asyncio.ensure_future(self._section(name, aw)))
+
+    async def _section(self, name: str, aw: Awaitable):
+        try:
+            await self._timed(name, aw)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            LogManager.instance().warning(f'[Loader] {self.name} 区块 {name} 加载失败 {err}')
+
+    async def wait(self):
+        """
+        等待全部区块完成并输出各区块耗时
+        """
+        await asyncio.gather(*self._sections)
+        timings = ' '.join(f'{k}={v:.1f}ms' for k, v in self.timings.items())
+        LogManager.instance().debug(f'[Loader] {self.name} 加载完成 {timings}')
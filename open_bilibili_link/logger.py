@@ -25,7 +25,7 @@ class LogManager(object):
             log_config = yaml.safe_load(f)
             if isinstance(log_config, dict):
                 handlers: list = log_config.get('loggers', {}).get(name.value, {}).get('handlers', [])
-                if 'console' in handlers and os.environ.get('OBL_DEBUG', 0) == '1':
+                if 'console' in handlers and self.debug_mode():
                     handlers.remove('console')
                     handlers.append('console_debug')
                     log_config['loggers'][name.value]['handlers'] = handlers
@@ -35,12 +35,22 @@ class LogManager(object):
                     log_config['handlers']['file']['filename'] = (self.LOG_DIRECTORY / base_fname).as_posix()
                 logging.config.dictConfig(log_config)
 
+    @staticmethod
+    def debug_mode() -> bool:
+        """
+        是否开启调试模式 (环境变量 OBL_DEBUG=1)
+        """
+        return os.environ.get('OBL_DEBUG', 0) == '1'
+
     @classmethod
     def instance(cls, name: LoggerName = LoggerName.default) -> 'LogManager':
         if name.value not in cls.instances.keys():
             cls.instances[name.value] = cls(name)
         return cls.instances[name.value]
 
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
     def debug(self, msg, *args, **kwargs):
         self._logger.debug(msg, *args, **kwargs)
 
@@ -0,0 +1,235 @@
+"""
+本地弹幕测试服务器
+
+模拟 room_init / getDanmuInfo 接口和弹幕 WebSocket, 使用与 encode_payload / decode_msg 相同的封包格式,
+按指定速率回放合成或录制的弹幕流量, 用于压测和基准测试
+
+用法:
+    python -m open_bilibili_link.mockserver --port 8080 --rate 500 --ver 2 [--source 消息体文件或录制文件]
+"""
+import argparse
+import asyncio
+import json
+import random
+from pathlib import Path
+from typing import List, Optional
+
+from aiohttp import web, WSMsgType
+
+from open_bilibili_link.danmu import encode_packet, compress_packets, PROTOVER_RAW, HEADER, DanmuDecoder, \
+    supported_protover
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.recorder import is_recording, read_frames
+
+# 操作类型
+OP_HEARTBEAT = 2
+OP_HEARTBEAT_REPLY = 3
+OP_MESSAGE = 5
+OP_JOIN_ROOM = 7
+OP_JOIN_REPLY = 8
+
+
+def synthetic_bodies(count=5000, seed=0) -> List[bytes]:
+    """
+    生成合成弹幕消息体, 消息结构和比例接近真实直播间 (弹幕/礼物/广播)
+    :param count: 消息数
+    :param seed: 随机种子
+    :return: JSON 消息体列表
+    :rtype: List[bytes]
+    """
+    rnd = random.Random(seed)
+    bodies = []
+    for i in range(count):
+        uid = rnd.randint(1, 10 ** 9)
+        kind = rnd.random()
+        if kind < 0.7:
+            body = {'cmd': 'DANMU_MSG', 'info': [
+                [0, 1, 25, 16777215, 1600000000000 + i, rnd.randint(0, 10 ** 9), 0, 'ae3f1a2b', 0, 0, 0],
+                '弹幕' * rnd.randint(1, 15), [uid, f'用户{uid}', 0, 0, 0, 10000, 1, ''],
+                [rnd.randint(1, 20), '粉丝牌', '主播', 496150, 6067854, '', 0], [rnd.randint(0, 60), 0, 9868950, '>50000'],
+                ['', ''], 0, 0, None, {'ts': 1600000000 + i, 'ct': '5C9A2B1D'}, 0, 0, None, None, 0, 105]}
+        elif kind < 0.9:
+            body = {'cmd': 'SEND_GIFT', 'data': {
+                'draw': 0, 'gold': 0, 'silver': 0, 'num': rnd.randint(1, 99), 'total_coin': 100, 'effect': 0,
+                'broadcast_id': 0, 'crit_prob': 0, 'guard_level': 0, 'rcost': 123456, 'uid': uid,
+                'timestamp': 1600000000 + i, 'giftType': 0, 'price': 100, 'action': '投喂', 'coin_type': 'silver',
+                'uname': f'用户{uid}', 'face': 'https://i0.hdslb.com/bfs/face/member/noface.jpg',
+                'giftName': '辣条'}}
+        else:
+            body = {'cmd': 'NOTICE_MSG', 'msg_type': 2, 'real_roomid': 496150,
+                    'msg_common': f'<%用户{uid}%> 在直播间开通了舰长', 'full': {'head_icon': '', 'tail_icon': ''}}
+        bodies.append(json.dumps(body, ensure_ascii=False).encode())
+    return bodies
+
+
+def load_bodies(path: Path) -> List[bytes]:
+    """
+    读取消息体文件, 每行一条 JSON 消息体; 也可以是弹幕录制文件, 此时使用其中的全部 op 5 消息体
+    """
+    if is_recording(path):
+        decoder = DanmuDecoder()
+        return [bytes(body) for _, data in read_frames(path)
+                for op, body in decoder.feed(data) if op == OP_MESSAGE]
+    with Path(path).open('rb') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class MockDanmuServer:
+    """
+    本地弹幕测试服务器
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, *, rate: float = 1000, ver: int = PROTOVER_RAW,
+                 batch: int = 10, bodies: List[bytes] = None, total: Optional[int] = None):
+        """
+        :param host: 监听地址
+        :param port: 监听端口, 0 为随机端口
+        :param rate: 每个连接每秒推送的消息数, 0 为不限速
+        :param ver: 推送使用的协议版本 (0/1 不压缩, 2 zlib, 3 brotli)
+        :param batch: 每帧包含的消息数
+        :param bodies: 循环回放的消息体, 默认为合成流量
+        :param total: 每个连接推送的消息总数, None 为不限
+        :raises ValueError: 协议版本未知, 或为 3 但未安装 brotli 模块
+        """
+        # 启动前检查协议版本, 避免推送任务在后台失败而没有任何输出
+        if ver and supported_protover(ver) != ver:
+            raise ValueError(f'protover {ver} requires the brotli module')
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.ver = ver
+        self.batch = batch
+        self.bodies = bodies if bodies is not None else synthetic_bodies()
+        self.total = total
+        self.popularity = 1
+        # 推送统计
+        self.connections = 0
+        self.sent = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_get('/room/v1/Room/room_init', self.room_init)
+        self.app.router.add_get('/xlive/web-room/v1/index/getDanmuInfo', self.danmu_info)
+        self.app.router.add_get('/sub', self.sub)
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+        LogManager.instance().debug(f'[Mock] 测试服务器已启动 {self.url}')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def configure(self, service):
+        """
+        将弹幕服务指向本测试服务器
+        :param service: BilibiliLiveDanmuService 实例
+        """
+        service.LIVE_API_URL = self.url
+        service.DANMU_WS_SCHEME = 'ws'
+
+    async def room_init(self, request: web.Request):
+        roomid = int(request.query.get('id', 0))
+        return web.json_response({'code': 0, 'msg': 'ok', 'message': 'ok', 'data': {
+            'room_id': roomid, 'short_id': 0, 'uid': 1, 'need_p2p': 0, 'is_hidden': False, 'is_locked': False,
+            'is_portrait': False, 'live_status': 1, 'hidden_till': 0, 'lock_till': 0, 'encrypted': False,
+            'pwd_verified': False, 'live_time': 0, 'room_shield': 0, 'is_sp': 0, 'special_type': 0}})
+
+    async def danmu_info(self, _):
+        return web.json_response({'code': 0, 'message': '0', 'ttl': 1, 'data': {
+            'group': 'live', 'business_id': 0, 'refresh_row_factor': 0.125, 'refresh_rate': 100,
+            'max_delay': 5000, 'token': 'mock',
+            'host_list': [{'host': self.host, 'port': self.port, 'wss_port': self.port, 'ws_port': self.port}]}})
+
+    async def sub(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        pusher = None
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.BINARY or len(msg.data) < HEADER.size:
+                    continue
+                _, header_len, _, op, _ = HEADER.unpack_from(msg.data)
+                if op == OP_JOIN_ROOM and pusher is None:
+                    await ws.send_bytes(encode_packet(b'{"code":0}', OP_JOIN_REPLY))
+                    pusher = asyncio.ensure_future(self.push(ws))
+                    pusher.add_done_callback(self._push_done)
+                elif op == OP_HEARTBEAT:
+                    await ws.send_bytes(encode_packet(self.popularity.to_bytes(4, 'big'), OP_HEARTBEAT_REPLY))
+        finally:
+            if pusher is not None:
+                pusher.cancel()
+        return ws
+
+    @staticmethod
+    def _push_done(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            LogManager.instance().error(f'[Mock] 推送失败 {task.exception()!r}')
+
+    def frame(self, bodies: List[bytes]) -> bytes:
+        packets = b''.join(encode_packet(body, OP_MESSAGE) for body in bodies)
+        return compress_packets(packets, self.ver)
+
+    async def push(self, ws: web.WebSocketResponse):
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        sent = 0
+        index = 0
+        while not ws.closed and (self.total is None or sent < self.total):
+            count = self.batch
+            if self.total is not None:
+                count = min(count, self.total - sent)
+            if self.rate:
+                # 按速率计算下一帧的发送时间
+                delay = started + (sent + count) / self.rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            bodies = [self.next_body(index + i) for i in range(count)]
+            index += count
+            await ws.send_bytes(self.frame(bodies))
+            sent += count
+            self.sent += count
+            if not self.rate:
+                await asyncio.sleep(0)
+
+    def next_body(self, index: int) -> bytes:
+        return self.bodies[index % len(self.bodies)]
+
+
+async def serve(args):
+    bodies = load_bodies(args.source) if args.source else None
+    server = MockDanmuServer(args.host, args.port, rate=args.rate, ver=args.ver, batch=args.batch, bodies=bodies)
+    await server.start()
+    print(f'Mock danmu server: {server.url}  (ws: ws://{server.host}:{server.port}/sub)')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in danmu server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second per connection, 0 = unlimited')
+    parser.add_argument('--ver', type=int, default=PROTOVER_RAW, choices=[0, 1, 2, 3], help='protocol version')
+    parser.add_argument('--batch', type=int, default=10, help='messages per frame')
+    parser.add_argument('--source', default=None, help='danmu recording, or file of JSON message bodies, one per line')
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+    except ValueError as err:
+        parser.error(str(err))
+
+
+if __name__ == '__main__':
+    main()
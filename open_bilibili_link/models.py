@@ -402,7 +402,7 @@ class WelcomeData(BaseModel):
     is_admin: bool
     svip: bool
     vip: bool
-    mock_effect: Optional[int]
+    mock_effect: Optional[int] = None
 
 
 class RoomBannerData(BaseModel):
@@ -422,9 +422,9 @@ class RoomRealTimeMessageUpdateData(BaseModel):
 
 class DanmuContent(BaseModel):
     cmd: str
-    type: Optional[int]
-    id: Optional[int]
-    data: Union[RoomRealTimeMessageUpdateData, WelcomeData, SendGiftData, Any, None]
+    type: Optional[int] = None
+    id: Optional[int] = None
+    data: Union[RoomRealTimeMessageUpdateData, WelcomeData, SendGiftData, Any, None] = None
 
 
 class DanmuData(BaseModel):
@@ -436,7 +436,42 @@ class DanmuData(BaseModel):
     content: Union[DanmuContent, str, bytes]
 
 
+class DanmuMessage:
+    """
+    弹幕消息
+
+    解码器输出的可信数据, 不经过 pydantic 校验; 字段与 DanmuData 一致,
+    gift/enter 消息的 content 为原始字典, 需要模型时调用 validate
+    """
+    __slots__ = ('msg_type', 'name', 'type', 'roomid', 'raw', 'content')
+
+    def __init__(self, msg_type: str, content: Union[dict, str, bytes] = None, name: Optional[str] = None,
+                 type: Optional[int] = None, roomid: Optional[int] = None, raw: Optional[dict] = None):
+        self.msg_type = msg_type
+        self.content = content
+        self.name = name
+        self.type = type
+        self.roomid = roomid
+        self.raw = raw
+
+    def validate(self) -> DanmuData:
+        """
+        校验并转换为 DanmuData
+        :return: 弹幕数据模型
+        :rtype: DanmuData
+        """
+        return DanmuData(msg_type=self.msg_type, name=self.name, type=self.type, roomid=self.roomid, raw=self.raw,
+                         content=self.content)
+
+    def __repr__(self):
+        return f'DanmuMessage(msg_type={self.msg_type!r}, name={self.name!r}, content={self.content!r})'
+
+
 # Configurations
 class LiveConfiguration(BaseModel):
     autosign: bool = Field(title='自动签到（直播）', description='是否开启直播自动签到', default=False)
     stop_after_obs: bool = Field(title='自动停播', description='OBS 退出后自动停止直播', default=False)
+    danmu_max_lines: int = Field(title='弹幕文本行数', description='OBS 弹幕文本源保留的最近弹幕行数, 0 为持续追加',
+                                 default=20, ge=0)
+    danmu_refresh_interval: float = Field(title='弹幕文本刷新间隔', description='OBS 弹幕文本源最短写入间隔 (秒)',
+                                          default=0.5, ge=0)
@@ -0,0 +1,158 @@
+import logging
+from collections import deque
+from time import perf_counter
+from typing import Optional, Deque
+
+from aiohttp import TCPConnector, ClientSession, TraceConfig, TraceRequestStartParams, TraceRequestEndParams, \
+    TraceResponseChunkReceivedParams
+
+from open_bilibili_link.logger import LogManager
+from open_bilibili_link.utils import Singleton
+
+
+class ConnectorManager(metaclass=Singleton):
+    """
+    共享网络连接池
+
+    所有服务的 ClientSession 共用同一个 TCPConnector (DNS 缓存, 单域名连接数限制, keep-alive),
+    会话不持有连接池, 由 close 在退出时统一关闭一次
+    """
+    # 总连接数
+    DEFAULT_LIMIT = 100
+    # 单个域名连接数
+    DEFAULT_LIMIT_PER_HOST = 10
+    # DNS 缓存时间 (秒)
+    DEFAULT_DNS_TTL = 300
+    # 空闲连接保持时间 (秒)
+    DEFAULT_KEEPALIVE_TIMEOUT = 30
+
+    def __init__(self):
+        self.limit = self.DEFAULT_LIMIT
+        self.limit_per_host = self.DEFAULT_LIMIT_PER_HOST
+        self.dns_ttl = self.DEFAULT_DNS_TTL
+        self.keepalive_timeout = self.DEFAULT_KEEPALIVE_TIMEOUT
+        self._connector: Optional[TCPConnector] = None
+
+    def configure(self, limit: int = None, limit_per_host: int = None, dns_ttl: int = None,
+                  keepalive_timeout: float = None):
+        """
+        修改连接池配置, 需在创建连接池 (第一个会话) 之前调用
+        :param limit: 总连接数
+        :param limit_per_host: 单个域名连接数
+        :param dns_ttl: DNS 缓存时间 (秒)
+        :param keepalive_timeout: 空闲连接保持时间 (秒)
+        """
+        if self._connector is not None:
+            LogManager.instance().warning('[Network] 连接池已创建, 配置将在重新创建后生效')
+        if limit is not None:
+            self.limit = limit
+        if limit_per_host is not None:
+            self.limit_per_host = limit_per_host
+        if dns_ttl is not None:
+            self.dns_ttl = dns_ttl
+        if keepalive_timeout is not None:
+            self.keepalive_timeout = keepalive_timeout
+
+    @property
+    def connector(self) -> TCPConnector:
+        if self._connector is None or self._connector.closed:
+            self._connector = TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                           use_dns_cache=True, ttl_dns_cache=self.dns_ttl,
+                                           keepalive_timeout=self.keepalive_timeout)
+        return self._connector
+
+    def session(self, **kwargs) -> ClientSession:
+        """
+        创建使用共享连接池的会话
+        :param kwargs: ClientSession 参数
+        :rtype: ClientSession
+        """
+        return ClientSession(connector=self.connector, connector_owner=False, **kwargs)
+
+    @property
+    def closed(self) -> bool:
+        return self._connector is None or self._connector.closed
+
+    async def close(self):
+        if not self.closed:
+            await self._connector.close()
+            LogManager.instance().debug('[Network] 连接池已关闭')
+        self._connector = None
+
+
+class RequestTiming:
+    """
+    单次请求耗时 (毫秒), 连接复用时 dns 和 connect 为 None
+    """
+    __slots__ = ('method', 'url', 'status', 'dns', 'connect', 'ttfb', 'total')
+
+    def __init__(self, method: str, url: str, status: int = None, dns: float = None, connect: float = None,
+                 ttfb: float = None, total: float = None):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.dns = dns
+        self.connect = connect
+        self.ttfb = ttfb
+        self.total = total
+
+    def __repr__(self):
+        fields = ' '.join(f'{k}={getattr(self, k):.1f}ms' for k in ('dns', 'connect', 'ttfb', 'total')
+                          if getattr(self, k) is not None)
+        return f'[{self.method}] {self.url} [{self.status}] {fields}'
+
+
+class RequestTimer:
+    """
+    请求耗时统计
+
+    通过 TraceConfig 只记录时间点, 不读取响应内容; 响应体读取完成时 (json/text/read) 生成一条 RequestTiming,
+    流式读取 (content.read) 的请求只有 ttfb
+    """
+    DEFAULT_HISTORY = 100
+
+    def __init__(self, history: int = DEFAULT_HISTORY):
+        self.records: Deque[RequestTiming] = deque(maxlen=history)
+        self.trace = TraceConfig()
+        self.trace.on_request_start.append(self.on_request_start)
+        self.trace.on_dns_resolvehost_start.append(self.on_dns_start)
+        self.trace.on_dns_resolvehost_end.append(self.on_dns_end)
+        self.trace.on_connection_create_start.append(self.on_connect_start)
+        self.trace.on_connection_create_end.append(self.on_connect_end)
+        self.trace.on_request_end.append(self.on_request_end)
+        self.trace.on_response_chunk_received.append(self.on_response_chunk_received)
+
+    @staticmethod
+    def _elapsed(since: float) -> float:
+        return (perf_counter() - since) * 1000
+
+    async def on_request_start(self, _, ctx, params: TraceRequestStartParams):
+        ctx.started = perf_counter()
+        ctx.timing = RequestTiming(params.method, str(params.url))
+
+    @staticmethod
+    async def on_dns_start(_, ctx, __):
+        ctx.dns_started = perf_counter()
+
+    async def on_dns_end(self, _, ctx, __):
+        ctx.timing.dns = self._elapsed(ctx.dns_started)
+
+    @staticmethod
+    async def on_connect_start(_, ctx, __):
+        ctx.connect_started = perf_counter()
+
+    async def on_connect_end(self, _, ctx, __):
+        ctx.timing.connect = self._elapsed(ctx.connect_started)
+
+    async def on_request_end(self, _, ctx, params: TraceRequestEndParams):
+        ctx.timing.status = params.response.status
+        ctx.timing.ttfb = self._elapsed(ctx.started)
+        self.records.append(ctx.timing)
+
+    async def on_response_chunk_received(self, _, ctx, __: TraceResponseChunkReceivedParams):
+        timing: RequestTiming = ctx.timing
+        if timing.total is None:
+            timing.total = self._elapsed(ctx.started)
+            # 日志级别高于 DEBUG 时不格式化, 参数延迟到处理器实际输出时才格式化
+            if LogManager.instance().isEnabledFor(logging.DEBUG):
+                LogManager.instance().debug('[Network] 请求耗时 %s', timing)
@@ -1,4 +1,4 @@
-from open_bilibili_link.models import DanmuData
+from open_bilibili_link.models import DanmuMessage
 from open_bilibili_link.services import BilibiliLiveDanmuService
 from open_bilibili_link.utils import run_command
 
@@ -15,7 +15,7 @@ __config__: dict = {}
 __loaded__ = False
 
 
-async def test_danmu_plugin(danmu: DanmuData):
+async def test_danmu_plugin(danmu: DanmuMessage):
     if danmu.msg_type == BilibiliLiveDanmuService.TYPE_DANMUKU and danmu.content. \
             startswith(__config__.get('prefix', '/FUO')):
         arguments = danmu.content[4:].strip().split()
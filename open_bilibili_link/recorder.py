@@ -0,0 +1,133 @@
+import asyncio
+import time
+from pathlib import Path
+from struct import Struct
+from typing import Iterator, Tuple, Callable, Awaitable, Optional, BinaryIO
+
+from open_bilibili_link.logger import LogManager
+
+# 文件头
+MAGIC = b'OBLDANMU\x01'
+# 记录头: 接收时间 (unix 时间戳) 帧长度
+RECORD = Struct('!dI')
+
+
+class RecordingError(Exception):
+    pass
+
+
+class DanmuRecorder:
+    """
+    弹幕原始帧录制器
+
+    以追加方式写入, 每帧为 记录头 + WebSocket 二进制消息原文; 文件为空时先写入文件头
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.frames = 0
+        self._file: Optional[BinaryIO] = self.path.open('ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        LogManager.instance().debug(f'[Recorder] 开始录制弹幕 {self.path}')
+
+    @property
+    def closed(self) -> bool:
+        return self._file is None
+
+    def write(self, data: bytes, timestamp: float = None):
+        """
+        写入一帧
+        :param data: WebSocket 二进制消息
+        :type data: bytes
+        :param timestamp: 接收时间, 默认为当前时间
+        :type timestamp: float
+        """
+        if self._file is None:
+            return
+        self._file.write(RECORD.pack(time.time() if timestamp is None else timestamp, len(data)))
+        self._file.write(data)
+        self.frames += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            LogManager.instance().debug(f'[Recorder] 录制结束 {self.path}, 共 {self.frames} 帧')
+
+
+def is_recording(path) -> bool:
+    """
+    判断文件是否为弹幕录制文件
+    """
+    with Path(path).open('rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_frames(path) -> Iterator[Tuple[float, bytes]]:
+    """
+    逐帧读取录制文件, 末尾不完整的帧 (如录制时进程退出) 会被忽略
+    :param path: 录制文件
+    :return: (接收时间, 帧数据) 迭代器
+    """
+    with Path(path).open('rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RecordingError(f'{path} is not a danmu recording')
+        while True:
+            header = f.read(RECORD.size)
+            if not header:
+                return
+            if len(header) < RECORD.size:
+                break
+            timestamp, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield timestamp, data
+    LogManager.instance().warning(f'[Recorder] 录制文件 {path} 末尾数据不完整, 已忽略')
+
+
+class DanmuReplayer:
+    """
+    弹幕录制回放器
+
+    speed 为 1 时按原始间隔回放, 大于 1 时加速, 为 0 时不等待尽快回放
+    """
+
+    def __init__(self, path, speed: float = 1.0):
+        if speed < 0:
+            raise ValueError('speed must not be negative')
+        self.path = Path(path)
+        self.speed = speed
+        self.frames = 0
+        self.bytes = 0
+
+    async def replay(self, feed: Callable[[bytes], Awaitable]):
+        """
+        回放录制文件
+        :param feed: 接收帧数据的协程函数, 如 DanmuConnection.feed
+        :return: 回放帧数
+        :rtype: int
+        """
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        first = None
+        for timestamp, data in read_frames(self.path):
+            if first is None:
+                first = timestamp
+            if self.speed:
+                delay = started + (timestamp - first) / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                # 让出事件循环, 订阅者得以消费队列
+                await asyncio.sleep(0)
+            await feed(data)
+            self.frames += 1
+            self.bytes += len(data)
+        return self.frames
@@ -1,25 +1,34 @@
 import asyncio
-import json
-import zlib
 from base64 import b64encode
+from datetime import datetime, timezone, timedelta
 from hashlib import md5
 from pathlib import Path
 from random import random
-from struct import unpack
-from time import time
-from typing import List, Optional
+from time import time, monotonic
+from typing import List, Optional, Dict, Callable
 from urllib.parse import quote_plus
 
 import rsa
-from aiocache import cached
-from aiohttp import ClientSession, CookieJar, TraceConfig, TraceRequestStartParams, WSMsgType, WSMessage, \
-    TraceRequestEndParams
+from aiohttp import ClientError, CookieJar, TraceConfig, TraceRequestStartParams, WSMsgType, WSMessage, \
+    TraceRequestEndParams, TraceResponseChunkReceivedParams
 
 from open_bilibili_link import models
+from open_bilibili_link.areas import AreaIndex
+from open_bilibili_link.cache import single_flight, api_cached, ApiCache, invalidates
+from open_bilibili_link.codec import loads, dumps
+from open_bilibili_link.danmu import DanmuDecoder, PROTOVER_BROTLI, supported_protover, COMMANDS, HeartbeatScheduler, \
+    encode_packet
+from open_bilibili_link.dispatch import DanmuSubscriber, OverflowPolicy, CallbackExecutor, DanmuBatchSubscriber
+from open_bilibili_link.images import ImageCache
 from open_bilibili_link.logger import LogManager
 from open_bilibili_link.models import UserInfoData, RoomInfoData, DanmuKeyResponse, DanmuKeyData, RoomInitResponse, \
-    DanmuData, RoomInitData, DanmuHistoryResponse
-from open_bilibili_link.utils import ping, Timer, color_hex_to_int, Singleton
+    DanmuMessage, RoomInitData, DanmuHistoryResponse
+from open_bilibili_link.network import ConnectorManager, RequestTimer
+from open_bilibili_link.recorder import DanmuRecorder, DanmuReplayer
+from open_bilibili_link.utils import ping, color_hex_to_int, Singleton, save_cookie
+
+# 弹幕历史等接口返回的时间为北京时间
+BEIJING_TIMEZONE = timezone(timedelta(hours=8))
 
 
 def login_required(func):
@@ -60,8 +69,9 @@ class BilibiliBaseService:
         'Referer': 'https://link.bilibili.com/p/center/index'
     }
 
-    # 接口缓存时间
+    # 接口缓存时间, 过期后在 STALE_TTL 内先返回旧值并在后台刷新
     DEFAULT_TTL = 600
+    STALE_TTL = 86400
 
     # 接口请求域名
     PASSPORT_API_HOST = 'passport.bilibili.com'
@@ -75,10 +85,15 @@ class BilibiliBaseService:
     CACHE_DIR = Path.home() / '.cache' / 'OBL'
     TOKEN_FILE = CACHE_DIR / 'token.json'
     COOKIE_FILE = CACHE_DIR / 'cookiejar'
-    FACE_CACHE_DIR = CACHE_DIR / 'faces'
     IMAGE_CACHE_DIR = CACHE_DIR / 'images'
+    API_CACHE_DIR = CACHE_DIR / 'api'
+
+    # 图片缓存重新验证间隔
+    IMAGE_TTL = 86400
 
     def __init__(self):
+        ApiCache().directory = self.API_CACHE_DIR
+        ImageCache().directory = self.IMAGE_CACHE_DIR
         self.cookie_jar = CookieJar()
         self.token_data = None
         if self.TOKEN_FILE.exists():
@@ -87,12 +102,19 @@ class BilibiliBaseService:
         if self.COOKIE_FILE.exists():
             LogManager.instance().debug('[Service] 正在加载 cookie 文件...')
             self.cookie_jar.load(self.COOKIE_FILE)
-        self.trace = TraceConfig()
-        self.trace.on_connection_create_end.append(self.on_connected)
-        self.trace.on_request_start.append(self.on_request_start)
-        self.trace.on_request_end.append(self.on_request_end)
-        self.session = ClientSession(cookie_jar=self.cookie_jar, headers=self.DEFAULT_HEADERS,
-                                     trace_configs=[self.trace])
+        self.timer = RequestTimer()
+        trace_configs = [self.timer.trace]
+        # 请求详情 (含响应内容) 仅在调试模式下记录
+        self.trace = None
+        if LogManager.debug_mode():
+            self.trace = TraceConfig()
+            self.trace.on_connection_create_end.append(self.on_connected)
+            self.trace.on_request_start.append(self.on_request_start)
+            self.trace.on_request_end.append(self.on_request_end)
+            self.trace.on_response_chunk_received.append(self.on_response_chunk_received)
+            trace_configs.append(self.trace)
+        self.session = ConnectorManager().session(cookie_jar=self.cookie_jar, headers=self.DEFAULT_HEADERS,
+                                                  trace_configs=trace_configs)
 
     @staticmethod
     async def on_connected(_, __, ___):
@@ -103,13 +125,22 @@ class BilibiliBaseService:
         LogManager.instance().debug(f'[Network] 网络请求: [{params.method}] {params.url}')
 
     @staticmethod
-    async def on_request_end(_, __, params: TraceRequestEndParams):
-        # 非文本类型仅输出 content-type 和 content-length
-        if params.response.content_type.startswith('text') or 'json' in params.response.content_type:
-            content = await params.response.text()
-        else:
-            content = f'{params.response.content_type}[{params.response.content_length}]'
-        LogManager.instance().debug(f'[Network] 网络请求完成 [{params.response.status}] {content}')
+    async def on_request_end(_, ctx, params: TraceRequestEndParams):
+        ctx.content_type = params.response.content_type
+        # 非文本类型仅输出 content-type 和 content-length, 文本内容在读取完成后输出
+        if not (ctx.content_type.startswith('text') or 'json' in ctx.content_type):
+            LogManager.instance().debug(f'[Network] 网络请求完成 [{params.response.status}] '
+                                        f'{ctx.content_type}[{params.response.content_length}]')
+
+    @staticmethod
+    async def on_response_chunk_received(_, ctx, params: TraceResponseChunkReceivedParams):
+        if ctx.content_type.startswith('text') or 'json' in ctx.content_type:
+            content = params.chunk.decode(errors='replace')
+            LogManager.instance().debug(f'[Network] 网络请求完成 {params.url} {content}')
+
+    async def close(self):
+        if not self.session.closed:
+            await self.session.close()
 
     @property
     def logged_in(self):
@@ -152,7 +183,7 @@ class BilibiliBaseService:
         uri = f'https://{self.PASSPORT_API_HOST}/api/oauth2/getKey'
         data = {'appkey': self.APPKEY, 'sign': self.calc_sign(f'appkey={self.APPKEY}')}
         async with self.session.post(uri, data=data) as r:
-            res = models.HashKeyResponse(**(await r.json()))
+            res = models.HashKeyResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException('', res.code)
             return res.data
@@ -181,21 +212,49 @@ class BilibiliBaseService:
         headers = self.DEFAULT_HEADERS
         headers['Content-type'] = 'application/x-www-form-urlencoded'
         async with self.session.post(uri, data=data, headers=headers) as r:
-            res = models.LoginResponse(**(await r.json()))
+            res = models.LoginResponse(**(await r.json(loads=loads)))
             if res.code == -105:
                 raise BilibiliServiceException(res.data.url, res.code)
             elif res.code != 0:
                 raise BilibiliServiceException(res.message or '', res.code)
             res.data.save_to_file(self.TOKEN_FILE)
             self.token_data = res.data
+            await self.switch_account()
             return res.data
 
+    async def cookie_login(self, cookie: str):
+        """
+        Cookie 登录, 保存 cookie 文件并立即生效
+        :param cookie: 浏览器请求头中的完整 Cookie
+        :type cookie: str
+        """
+        save_cookie(cookie, self.COOKIE_FILE, '.live.bilibili.com')
+        self.cookie_jar.clear()
+        self.cookie_jar.load(self.COOKIE_FILE)
+        await self.switch_account()
+
+    async def switch_account(self):
+        """
+        登录帐号变化 (登录/退出登录) 时调用, 清空接口缓存, 避免返回上一个帐号的数据
+        """
+        await ApiCache().clear()
+
+    async def logout(self):
+        """
+        退出登录, 删除 token 和 cookie 文件并清空接口缓存
+        """
+        self.TOKEN_FILE.unlink(missing_ok=True)
+        self.COOKIE_FILE.unlink(missing_ok=True)
+        self.token_data = None
+        self.cookie_jar.clear()
+        await self.switch_account()
+
     @login_required
     async def stat(self):
         uri = f'https://{self.MAIN_API_HOST}/x/web-interface/nav/stat'
         async with self.session.get(uri, headers=self.DEFAULT_HEADERS,
                                     params=self.with_token()) as r:
-            return await r.json()
+            return await r.json(loads=loads)
 
     @login_required
     def get_user_id(self) -> int:
@@ -232,7 +291,8 @@ class BilibiliBaseService:
         raise BilibiliServiceException('csrf not found in cookie', -90003)
 
     @login_required
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=DEFAULT_TTL, stale=STALE_TTL)
+    @single_flight
     async def get_user_info(self) -> models.UserInfoData:
         """
         获取用户信息
@@ -246,24 +306,13 @@ class BilibiliBaseService:
         headers['Referer'] = f'https://space.bilibili.com/{self.get_user_id()}/'
         async with self.session.get(uri, headers=headers,
                                     params=self.with_token()) as r:
-            res = models.UserInfoResponse(**(await r.json()))
+            res = models.UserInfoResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
-    @classmethod
-    async def get_cached_face(cls, userinfo: UserInfoData):
-        target = cls.FACE_CACHE_DIR / f'{userinfo.mid}.png'
-        if target.exists():
-            with target.open('rb') as f:
-                return f.read()
-        target.parent.mkdir(parents=True)
-        async with cls().session.get(userinfo.face) as r:
-            with target.open('wb') as f:
-                data = await r.content.read()
-                f.write(data)
-                f.flush()
-            return data
+    async def get_cached_face(self, userinfo: UserInfoData) -> bytes:
+        return await ImageCache().get(self.session, userinfo.face, self.IMAGE_TTL)
 
 
 class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
@@ -274,20 +323,32 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
 
     # 接口缓存时间
     DEFAULT_TTL = 600
+    STALE_TTL = 86400
+    ROOM_TTL = 60
+    # 直播关键帧缓存重新验证间隔
+    KEYFRAME_TTL = 60
+    AREA_TTL = 86400
+    AREA_STALE_TTL = 30 * 86400
+    AREA_INDEX_FILE = 'index.pickle'
 
     def __init__(self):
         super().__init__()
         self.host = self.LIVE_API_HOST
         self._roomid = 0
-        self._live_status = None
+        self._areaid = 0
+        self._area_index: Optional[AreaIndex] = None
+
+    async def switch_account(self):
+        await super().switch_account()
+        # 直播间号和分区由接口缓存推导, 一并重置
+        self._roomid = 0
         self._areaid = 0
 
     @property
     async def areaid(self):
         if self._areaid:
             return self._areaid
-        await self.live_info()
-        return self._areaid
+        return (await self.get_room_info()).area_id
 
     @areaid.setter
     def areaid(self, v):
@@ -302,24 +363,19 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
         _, time_ = await ping(self.host)
         return time_
 
-    @classmethod
-    async def get_image(cls, url):
-        async with cls().session.get(url) as r:
-            return await r.content.read()
+    async def get_image(self, url, ttl=KEYFRAME_TTL) -> bytes:
+        """
+        获取图片, 经过图片缓存
+        :param url: 图片地址
+        :param ttl: 缓存重新验证间隔 (秒), 默认按直播关键帧处理
+        :type ttl: float
+        :return: 图片数据
+        :rtype: bytes
+        """
+        return await ImageCache().get(self.session, url, ttl)
 
-    @classmethod
-    async def get_cached_background(cls, roominfo: RoomInfoData):
-        target = cls.IMAGE_CACHE_DIR / f'{roominfo.room_id}.jpg'
-        if target.exists():
-            with target.open('rb') as f:
-                return f.read()
-        target.parent.mkdir(parents=True)
-        async with cls().session.get(roominfo.background) as r:
-            with target.open('wb') as f:
-                data = await r.content.read()
-                f.write(data)
-                f.flush()
-            return data
+    async def get_cached_background(self, roominfo: RoomInfoData) -> bytes:
+        return await ImageCache().get(self.session, roominfo.background, self.IMAGE_TTL)
 
     @property
     @login_required
@@ -331,61 +387,55 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
         """
         if self._roomid > 0:
             return self._roomid
-        await self.live_info()
+        self._roomid = int((await self.live_info()).roomid)
         return self._roomid
 
     @property
     async def live_status(self):
-        if self._live_status is not None:
-            return self._live_status
-        await self.get_room_info()
-        return self._live_status
-
-    @live_status.setter
-    def live_status(self, v):
-        self._live_status = v
+        return (await self.get_room_info()).live_status
 
     @login_required
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=DEFAULT_TTL, stale=STALE_TTL)
+    @single_flight
     async def live_info(self) -> models.LiveInfoData:
         """
-        获取我的直播信息 并缓存 room_id
+        获取我的直播信息
         :raises BilibiliServiceException
         :return: 直播信息数据
         :rtype: models.LiveInfoData
         """
         uri = f'https://{self.host}/live_user/v1/UserInfo/live_info'
         async with self.session.get(uri, params=self.with_token()) as r:
-            res = models.LiveInfoResponse(**(await r.json()))
+            res = models.LiveInfoResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
-            self._roomid = int(res.data.roomid)
             return res.data
 
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=ROOM_TTL)
+    @single_flight
     async def get_room_info(self, roomid=None):
         uri = f'https://{self.host}/room/v1/Room/get_info'
         async with self.session \
                 .get(uri,
                      params=self.with_token({'room_id': roomid if roomid is not None else (await self.roomid)})) as r:
-            res = models.RoomInfoResponse(**(await r.json()))
+            res = models.RoomInfoResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
-            self._live_status = res.data.live_status
-            self._areaid = res.data.area_id
             return res.data
 
     @login_required
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=DEFAULT_TTL)
+    @single_flight
     async def check_info(self):
         uri = f'https://{self.host}/xlive/web-ucenter/v1/sign/WebGetSignInfo'
         async with self.session.get(uri, params=self.with_token()) as r:
-            res = models.LiveCheckInfoResponse(**(await r.json()))
+            res = models.LiveCheckInfoResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @invalidates('check_info')
     async def checkin(self) -> models.LiveCheckinData:
         """
         签到
@@ -395,12 +445,13 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
         """
         uri = f'https://{self.host}/xlive/web-ucenter/v1/sign/DoSign'
         async with self.session.get(uri, params=self.with_token()) as r:
-            res = models.LiveCheckinResponse(**(await r.json()))
+            res = models.LiveCheckinResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=AREA_TTL, stale=AREA_STALE_TTL)
+    @single_flight
     async def get_live_areas(self) -> List[models.LiveAreaResponse.LiveAreaCategory]:
         """
         获取直播分区信息
@@ -410,12 +461,27 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
         """
         uri = f'https://{self.host}/room/v1/Area/getList'
         async with self.session.get(uri, params={'show_pinyin': 1}) as r:
-            res = models.LiveAreaResponse(**(await r.json()))
+            res = models.LiveAreaResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
-    @cached(ttl=DEFAULT_TTL)
+    async def get_area_index(self) -> AreaIndex:
+        """
+        获取直播分区搜索索引, 持久化在分区接口缓存目录中, 分区数据变化时重建
+        :return: 分区索引
+        :rtype: AreaIndex
+        """
+        categories = await self.get_live_areas()
+        if self._area_index is None or self._area_index.categories is not categories:
+            path = None
+            if ApiCache().directory is not None:
+                path = ApiCache().directory / self.get_live_areas.endpoint / self.AREA_INDEX_FILE
+            self._area_index = await asyncio.get_event_loop().run_in_executor(None, AreaIndex.load, categories, path)
+        return self._area_index
+
+    @api_cached(ttl=DEFAULT_TTL, stale=STALE_TTL)
+    @single_flight
     async def get_history_areas(self, roomid=None) -> List[models.LiveAreaHistoryResponse.HistoryLiveArea]:
         """
         获取历史直播分区信息
@@ -425,12 +491,13 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
         """
         uri = f'https://{self.host}/room/v1/Area/getMyChooseArea?roomid=496150'
         async with self.session.get(uri, params={'roomid': roomid or (await self.roomid)}) as r:
-            res = models.LiveAreaHistoryResponse(**(await r.json()))
+            res = models.LiveAreaHistoryResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @invalidates('get_room_info', 'live_info', 'get_live_code', 'get_history_areas')
     async def start_live(self, areaid: int = None) -> models.StartLiveData:
         """
         开始直播
@@ -444,22 +511,24 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
         data = self.with_csrf({'room_id': await self.roomid, 'platform': 'pc',
                                'area_v2': areaid or (await self.areaid)})
         async with self.session.post(uri, params=self.with_token(), data=data) as r:
-            res = models.StartLiveResponse(**(await r.json()))
+            res = models.StartLiveResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @invalidates('get_room_info', 'live_info')
     async def stop_live(self):
         uri = f'https://{self.LIVE_API_HOST}/room/v1/Room/stopLive'
         data = self.with_csrf({'room_id': await self.roomid, 'platform': 'pc'})
         async with self.session.post(uri, params=self.with_token(), data=data) as r:
-            res = models.StopLiveResponse(**(await r.json()))
+            res = models.StopLiveResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @invalidates('get_room_info', 'live_info', 'get_history_areas')
     async def update_room(self, **kwargs):
         """
         :param kwargs: See kwargs
@@ -475,37 +544,40 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
             if value is not None:
                 data[key] = value
         async with self.session.post(uri, params=self.with_token(), data=data) as r:
-            res = models.BaseResponseV2(**(await r.json()))
+            res = models.BaseResponseV2(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
 
     @login_required
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=DEFAULT_TTL, persist=False)
+    @single_flight
     async def get_live_code(self):
         uri = f'https://{self.LIVE_API_HOST}/live_stream/v1/StreamList/get_stream_by_roomId'
         params = self.with_token({'room_id': await self.roomid})
         async with self.session.get(uri, params=params) as r:
-            res = models.LiveCodeResponse(**(await r.json()))
+            res = models.LiveCodeResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=DEFAULT_TTL)
+    @single_flight
     async def get_loop_status(self):
         uri = f'https://{self.host}/i/api/round'
         async with self.session.get(uri, params=self.with_token()) as r:
-            res = models.LiveLoopStatusResponse(**(await r.json()))
+            res = models.LiveLoopStatusResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @invalidates('get_loop_status')
     async def set_loop_status(self, status: bool):
         uri = f'https://{self.host}/i/ajaxRoundOn'
         data = self.with_csrf({'on': int(status)})
         async with self.session.post(uri, data=data, params=self.with_token()) as r:
-            res = models.BaseResponseV2(**(await r.json()))
+            res = models.BaseResponseV2(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
 
@@ -522,215 +594,535 @@ class BilibiliLiveService(BilibiliBaseService, metaclass=Singleton):
             'bubble': bubble,
         })
         async with self.session.post(uri, data=data, params=self.with_token()) as r:
-            res = models.BaseResponseV2(**(await r.json()))
+            res = models.BaseResponseV2(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
-    @cached(ttl=DEFAULT_TTL)
+    @api_cached(ttl=DEFAULT_TTL, stale=STALE_TTL)
+    @single_flight
     async def get_live_news(self, roomid=None):
         uri = f'https://{self.host}/room_ex/v1/RoomNews/get'
         async with self.session.get(uri, params={'roomid': roomid or (await self.roomid)}) as r:
-            res = models.LiveNewsResponse(**(await r.json()))
+            res = models.LiveNewsResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @invalidates('get_live_news')
     async def update_live_news(self, content):
         uri = f'https://{self.host}/room_ex/v1/RoomNews/update'
         data = self.with_csrf({'roomid': await self.roomid, 'content': content})
         async with self.session.post(uri, data=data,
                                      params=self.with_token()) as r:
-            res = models.BaseResponseV2(**(await r.json()))
+            res = models.BaseResponseV2(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
     @login_required
+    @single_flight
     async def get_danmu_history(self, roomid=None) -> List[DanmuHistoryResponse.DanmuHistoryData.DanmuHistory]:
         uri = f'https://{self.host}/xlive/web-room/v1/dM/gethistory'
         data = self.with_csrf({'roomid': roomid or (await self.roomid), 'visit_id': ''})
         async with self.session.post(uri, data=data, params=self.with_token()) as r:
-            res = models.DanmuHistoryResponse(**(await r.json()))
+            res = models.DanmuHistoryResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data.room
 
 
+class DanmuConnection:
+    """
+    单个直播间的弹幕连接及其订阅者
+
+    连接断开后轮换 host_list 中的服务器并刷新 token, 按带抖动的指数退避重连,
+    重连成功后从弹幕历史补齐断线期间的弹幕
+    """
+    # 重连退避 (秒)
+    BACKOFF_BASE = 1
+    BACKOFF_MAX = 60
+    # 连接保持超过该时长后重置退避
+    BACKOFF_RESET = 30
+    # 补齐弹幕时获取弹幕历史的超时 (秒), 超时后放弃补齐
+    FILL_GAP_TIMEOUT = 10
+
+    def __init__(self, service: 'BilibiliLiveDanmuService', roomid: int):
+        self.service = service
+        self.roomid = roomid
+        self.ws = None
+        self.decoder = DanmuDecoder()
+        self.subscribers: Dict[Callable, DanmuSubscriber] = {}
+        # 正在连接或已连接
+        self.running = False
+        self.stopping = False
+        self.hosts: List[str] = []
+        self.host_index = 0
+        self.failures = 0
+        # 连接统计: 人气值 (心跳回复), 重连次数, 累计断线时长 (秒)
+        self.popularity = 0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.disconnected_at: Optional[float] = None
+        self.disconnected_time: Optional[datetime] = None
+        # 原始帧录制器
+        self.recorder: Optional[DanmuRecorder] = None
+        # supervise 任务, close 时取消
+        self.task: Optional[asyncio.Future] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.ws is None or self.ws.closed
+
+    @property
+    def retained(self) -> bool:
+        """
+        是否仍有内部订阅者需要保持连接
+        """
+        return any(not s.external for s in self.subscribers.values()) or \
+            any(not s.external for s in self.service.subscribers.values())
+
+    @property
+    def url(self) -> str:
+        if not self.hosts:
+            return self.service.DANMU_WS
+        return self.hosts[self.host_index % len(self.hosts)]
+
+    async def supervise(self):
+        """
+        保持连接直到被主动关闭
+        """
+        self.running = True
+        self.stopping = False
+        try:
+            while not self.stopping:
+                opened_at = None
+                try:
+                    token_data = await self.service.get_danmu_key(self.roomid)
+                    self.hosts = self.service.host_urls(token_data)
+                    async with self.service.session.ws_connect(self.url) as ws:
+                        # 获取 token 或握手期间已被关闭
+                        if self.stopping:
+                            break
+                        opened_at = monotonic()
+                        self.ws = ws
+                        self.service.heartbeat.add(self)
+                        await self._opened()
+                        await self.run(ws, token_data.token)
+                except (ClientError, OSError, asyncio.TimeoutError, BilibiliServiceException) as err:
+                    LogManager.instance().warning(f'[WebSocket] 直播间 {self.roomid} 连接异常 {self.url}: {err}')
+                finally:
+                    self.ws = None
+                    self.service.heartbeat.discard(self)
+                if self.stopping:
+                    break
+                # 只有曾经连上后断开才开始计算断线, 首次连接失败不算作断线
+                if self.disconnected_at is None and opened_at is not None:
+                    self.disconnected_at = monotonic()
+                    self.disconnected_time = datetime.now(timezone.utc)
+                if opened_at is not None and monotonic() - opened_at >= self.BACKOFF_RESET:
+                    self.failures = 0
+                else:
+                    self.failures += 1
+                    self.host_index += 1
+                delay = random() * min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** self.failures)
+                LogManager.instance().warning(f'[WebSocket] 直播间 {self.roomid} 连接断开, {delay:.1f} 秒后重连')
+                await asyncio.sleep(delay)
+        finally:
+            self.running = False
+
+    async def _opened(self):
+        if self.disconnected_at is None:
+            return
+        self.reconnects += 1
+        self.downtime += monotonic() - self.disconnected_at
+        since = self.disconnected_time
+        self.disconnected_at = None
+        self.disconnected_time = None
+        LogManager.instance().debug(f'[WebSocket] 直播间 {self.roomid} 已重连, 累计重连 {self.reconnects} 次')
+        # 在加入房间 (run) 之前补齐, 实时弹幕不会早于补齐的弹幕, 也不会与其重复
+        await self.fill_gap(since, datetime.now(timezone.utc))
+
+    async def fill_gap(self, since: datetime, until: datetime):
+        """
+        从弹幕历史补齐断线期间的弹幕
+        :param since: 断线时间
+        :type since: datetime
+        :param until: 重连时间, 之后的弹幕由实时连接接收
+        :type until: datetime
+        """
+        if not BilibiliLiveService().logged_in:
+            return
+        try:
+            history = await asyncio.wait_for(BilibiliLiveService().get_danmu_history(self.roomid),
+                                             self.FILL_GAP_TIMEOUT)
+        except (ClientError, asyncio.TimeoutError, BilibiliServiceException) as err:
+            LogManager.instance().warning(f'[WebSocket] 直播间 {self.roomid} 补齐弹幕失败 {err!r}')
+            return
+        for item in history:
+            # 弹幕历史时间为不带时区的北京时间
+            timeline = item.timeline if item.timeline.tzinfo else item.timeline.replace(tzinfo=BEIJING_TIMEZONE)
+            if since < timeline <= until:
+                await self.dispatch(DanmuMessage(self.service.TYPE_DANMUKU, item.text, name=item.nickname))
+
+    async def run(self, ws, token: str):
+        self.decoder.reset()
+        payload = {'uid': int(1e14 + 2e14 * random()), 'roomid': self.roomid, 'protover': self.service.protover,
+                   'platform': 'web', 'clientver': '1.14.1', 'type': 2, 'key': token}
+        await ws.send_bytes(self.service.encode_payload(payload, type_=self.service.TYPE_JOIN_ROOM))
+        async for msg in ws:
+            msg: WSMessage
+            if msg.type == WSMsgType.BINARY:
+                if self.recorder is not None:
+                    self.recorder.write(msg.data)
+                await self.feed(msg.data)
+            else:
+                LogManager.instance().info(f'[WebSocket] 接收到未知消息 {msg}')
+
+    async def feed(self, data):
+        """
+        解码一帧数据并分发给本房间及全局订阅者, 心跳回复只更新人气值, 不分发
+        :param data: WebSocket 二进制消息
+        :type data: bytes
+        """
+        for danmu in self.service.decode_msg(data, self.decoder):
+            if danmu.msg_type == self.service.TYPE_POPULARITY:
+                self.popularity = danmu.content
+                continue
+            await self.dispatch(danmu)
+
+    async def dispatch(self, danmu: DanmuMessage):
+        for subscriber in list(self.subscribers.values()):
+            await subscriber.put(danmu)
+        for subscriber in list(self.service.subscribers.values()):
+            await subscriber.put(danmu)
+
+    async def close(self):
+        self.stopping = True
+        for subscriber in self.subscribers.values():
+            subscriber.close()
+        self.subscribers.clear()
+        self.stop_recording()
+        # 连接可能仍在获取 token 或握手, 直接取消
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        if not self.closed:
+            await self.ws.close()
+
+    def record(self, path):
+        """
+        开始录制原始帧, 追加写入文件
+        :param path: 录制文件
+        """
+        self.stop_recording()
+        self.recorder = DanmuRecorder(path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+
 class BilibiliLiveDanmuService(metaclass=Singleton):
+    """
+    Bilibili 直播弹幕服务
+
+    按直播间管理弹幕连接, 所有连接共享同一个网络会话和心跳调度器;
+    订阅者可订阅单个直播间或全部直播间 (roomid=None)
+    """
     # API 域名
     LIVE_API_HOST = 'api.live.bilibili.com'
+    LIVE_API_URL = f'https://{LIVE_API_HOST}'
 
-    # 弹幕地址
+    # 弹幕地址, host_list 为空时使用
     DANMU_WS = 'wss://broadcastlv.chat.bilibili.com/sub'
+    DANMU_WS_SCHEME = 'wss'
+
+    # 心跳间隔
+    HEARTBEAT_INTERVAL = 30
 
     # 操作类型
     TYPE_JOIN_ROOM = 7
     TYPE_HEARTBEAT = 2
+    TYPE_HEARTBEAT_REPLY = 3
+    TYPE_MESSAGE = 5
 
     # 消息类型
     TYPE_DANMUKU = 'danmaku'
     TYPE_ENTER = 'enter'
     TYPE_BROADCAST = 'broadcast'
     TYPE_GIFT = 'gift'
+    TYPE_POPULARITY = 'popularity'
     TYPE_OTHER = 'other'
 
+    # 弹幕命令处理器, 插件可通过 commands.register 扩展
+    commands = COMMANDS
+
+    # 默认协议版本 (brotli 压缩)
+    DEFAULT_PROTOVER = PROTOVER_BROTLI
+
     def __init__(self):
         super().__init__()
-        self.ws = None
-        self.timer: Optional[Timer] = None
-        self.callbacks = set()
-        self.external_callbacks = set()
-        self.session = ClientSession()
-
-    def register_callback(self, callback, external=True):
-        if external:
-            self.external_callbacks.add(callback)
+        self._protover = supported_protover(self.DEFAULT_PROTOVER)
+        self.heartbeat = HeartbeatScheduler(self.HEARTBEAT_INTERVAL, self.encode_payload('[object Object]'))
+        self.connections: Dict[int, DanmuConnection] = {}
+        # 全局订阅者, 接收所有直播间的消息
+        self.subscribers: Dict[Callable, DanmuSubscriber] = {}
+        self.executor = CallbackExecutor()
+        self.timer = RequestTimer()
+        self.session = ConnectorManager().session(trace_configs=[self.timer.trace])
+
+    @property
+    def protover(self) -> int:
+        """
+        加入房间时使用的协议版本, 下次连接时生效
+        """
+        return self._protover
+
+    @protover.setter
+    def protover(self, v: int):
+        self._protover = supported_protover(v)
+
+    def _subscribe(self, roomid, subscriber: DanmuSubscriber):
+        if roomid is None:
+            subscribers = self.subscribers
         else:
-            self.callbacks.add(callback)
+            if roomid not in self.connections:
+                self.connections[roomid] = DanmuConnection(self, roomid)
+            subscribers = self.connections[roomid].subscribers
+        previous = subscribers.pop(subscriber.callback, None)
+        if previous is not None:
+            previous.close()
+        subscribers[subscriber.callback] = subscriber
+
+    def register_callback(self, callback, external=True, validate=False, maxsize=DanmuSubscriber.DEFAULT_MAXSIZE,
+                          overflow=OverflowPolicy.drop_oldest, threaded=True, roomid=None):
+        """
+        注册弹幕回调, 每个回调拥有独立的有界队列
+        :param callback: 回调方法, 默认接收未经校验的 DanmuMessage
+        :param external: 是否为外部 (插件) 回调
+        :param validate: 是否经过 pydantic 完整校验, 为 True 时接收 DanmuData
+        :type validate: bool
+        :param maxsize: 队列长度
+        :type maxsize: int
+        :param overflow: 队列溢出策略
+        :type overflow: OverflowPolicy
+        :param threaded: 同步回调是否在线程池中执行, 操作 Qt 组件的回调需设为 False
+        :type threaded: bool
+        :param roomid: 订阅的直播间 (真实房间号), 为 None 时订阅全部直播间
+        :type roomid: Optional[int]
+        """
+        self._subscribe(roomid, DanmuSubscriber(callback, external=external, validate=validate, maxsize=maxsize,
+                                                overflow=overflow, threaded=threaded, executor=self.executor))
 
-    def unregister_callback(self, callback):
-        try:
-            self.callbacks.remove(callback)
-            self.external_callbacks.remove(callback)
-        except KeyError:
-            pass
-        if len(self.callbacks) == 0:
-            if self.timer is not None:
-                self.timer.cancel()
-            asyncio.gather(self.ws.close())
+    def register_batch_callback(self, callback, interval=DanmuBatchSubscriber.DEFAULT_INTERVAL,
+                                batch_size=DanmuBatchSubscriber.DEFAULT_BATCH_SIZE, external=True, validate=False,
+                                maxsize=DanmuSubscriber.DEFAULT_MAXSIZE, overflow=OverflowPolicy.drop_oldest,
+                                threaded=True, roomid=None):
+        """
+        注册批量弹幕回调, 回调接收消息列表
+        :param callback: 回调方法
+        :param interval: 时间窗口 (秒)
+        :type interval: float
+        :param batch_size: 单批最大消息数
+        :type batch_size: int
+        其余参数同 register_callback
+        """
+        self._subscribe(roomid, DanmuBatchSubscriber(
+            callback, interval=interval, batch_size=batch_size, external=external, validate=validate,
+            maxsize=maxsize, overflow=overflow, threaded=threaded, executor=self.executor))
+
+    def unregister_callback(self, callback, close=True):
+        """
+        取消注册弹幕回调, 不再有内部订阅者的直播间连接将被关闭
+        :param callback: 回调方法
+        :param close: 是否关闭空闲连接
+        :type close: bool
+        """
+        for subscribers in [self.subscribers] + [c.subscribers for c in self.connections.values()]:
+            subscriber = subscribers.pop(callback, None)
+            if subscriber is not None:
+                subscriber.close()
+        if close:
+            for roomid, connection in list(self.connections.items()):
+                if not connection.retained:
+                    self.connections.pop(roomid)
+                    asyncio.gather(connection.close())
+
+    async def subscribe(self, roomid, callback, batch=False, **kwargs) -> int:
+        """
+        订阅直播间弹幕, 连接未建立时自动连接
+        :param roomid: 直播间号 (可为短号)
+        :param callback: 回调方法
+        :param batch: 是否批量投递
+        :type batch: bool
+        :param kwargs: 同 register_callback / register_batch_callback
+        :return: 真实房间号
+        :rtype: int
+        """
+        kwargs.setdefault('external', False)
+        roomid = (await self.room_init(roomid)).room_id
+        if batch:
+            self.register_batch_callback(callback, roomid=roomid, **kwargs)
+        else:
+            self.register_callback(callback, roomid=roomid, **kwargs)
+        connection = self.connections[roomid]
+        if connection.task is None or connection.task.done():
+            asyncio.gather(self.ws_connect(roomid))
+        return roomid
+
+    def unsubscribe(self, callback):
+        self.unregister_callback(callback)
+
+    async def replay(self, path, roomid=0, speed=1.0) -> int:
+        """
+        回放录制文件, 帧数据经过与实时连接相同的解码和订阅者分发
+        :param path: 录制文件
+        :param roomid: 分发目标直播间 (真实房间号), 该直播间及全局订阅者会收到消息
+        :type roomid: int
+        :param speed: 回放速度, 1 为原速, 0 为尽快回放
+        :type speed: float
+        :return: 回放帧数
+        :rtype: int
+        """
+        # 使用独立的解码器, 不影响该直播间正在进行的实时连接
+        connection = DanmuConnection(self, roomid)
+        if roomid in self.connections:
+            connection.subscribers = self.connections[roomid].subscribers
+        frames = await DanmuReplayer(path, speed).replay(connection.feed)
+        # 等待订阅者处理完全部消息后返回
+        subscribers = list(connection.subscribers.values()) + list(self.subscribers.values())
+        await asyncio.gather(*(s.join() for s in subscribers))
+        return frames
+
+    async def close(self):
+        """
+        关闭所有弹幕连接, 停止所有订阅者并释放线程池和网络会话
+        """
+        for subscriber in self.subscribers.values():
+            subscriber.close()
+        self.subscribers.clear()
+        for connection in self.connections.values():
+            await connection.close()
+        self.connections.clear()
+        self.heartbeat.cancel()
+        self.executor.shutdown()
+        if not self.session.closed:
+            await self.session.close()
+
+    @property
+    def dropped(self) -> int:
+        """
+        所有订阅者因队列溢出丢弃的消息总数
+        """
+        subscribers = list(self.subscribers.values())
+        for connection in self.connections.values():
+            subscribers.extend(connection.subscribers.values())
+        return sum(s.dropped for s in subscribers)
 
+    @single_flight
     async def get_danmu_key(self, roomid) -> DanmuKeyData:
         params = {'id': roomid, 'type': 0}
-        async with self.session.get(f'https://{self.LIVE_API_HOST}/xlive/web-room/v1/index/getDanmuInfo',
+        async with self.session.get(f'{self.LIVE_API_URL}/xlive/web-room/v1/index/getDanmuInfo',
                                     params=params) as r:
-            res = DanmuKeyResponse(**(await r.json()))
+            res = DanmuKeyResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
             return res.data
 
-    @staticmethod
-    def decode_msg(data):
-        dm_list_compressed = []
-        dm_list = []
-        ops = []
+    @classmethod
+    def decode_msg(cls, data, decoder: DanmuDecoder = None):
+        """
+        解码弹幕数据
+        :param data: WebSocket 二进制消息
+        :param decoder: 增量解码器, 传入时可处理跨消息的半包
+        :type decoder: Optional[DanmuDecoder]
+        :return: 消息列表
+        :rtype: List[DanmuMessage]
+        """
+        if decoder is None:
+            decoder = DanmuDecoder()
         msgs = []
-        while True:
+        for op, body in decoder.feed(data):
             try:
-                packet_len, header_len, ver, op, seq = unpack('!IHHII', data[0:16])
-            except:
-                break
-            if len(data) < packet_len:
-                break
-            if ver == 1 or ver == 0:
-                ops.append(op)
-                dm_list.append(data[16:packet_len])
-            elif ver == 2:
-                dm_list_compressed.append(data[16:packet_len])
-            if len(data) == packet_len:
-                data = b''
-                break
-            else:
-                data = data[packet_len:]
-        for dm in dm_list_compressed:
-            d = zlib.decompress(dm)
-            while True:
-                try:
-                    packet_len, header_len, ver, op, seq = unpack('!IHHII', d[0:16])
-                except:
-                    break
-                if len(d) < packet_len:
-                    break
-                ops.append(op)
-                dm_list.append(d[16:packet_len])
-                if len(d) == packet_len:
-                    d = b''
-                    break
-                else:
-                    d = d[packet_len:]
-        for i, d in enumerate(dm_list):
-            try:
-                msg = {}
-                if ops[i] == 5:
-                    j = json.loads(d)
-                    msg['msg_type'] = {'SEND_GIFT': 'gift', 'DANMU_MSG': 'danmaku',
-                                       'WELCOME': 'enter', 'NOTICE_MSG': 'broadcast'}.get(j.get('cmd'), 'other')
-                    if msg['msg_type'] == 'danmaku':
-                        msg['name'] = (j.get('info', ['', '', ['', '']])[2][1]
-                                       or j.get('data', {}).get('uname', ''))
-                        msg['content'] = j.get('info', ['', ''])[1]
-                    elif msg['msg_type'] == 'broadcast':
-                        msg['type'] = j.get('msg_type', 0)
-                        msg['roomid'] = j.get('real_roomid', 0)
-                        msg['content'] = j.get('msg_common', 'none')
-                        msg['raw'] = j
-                    else:
-                        msg['content'] = j
-                else:
-                    msg = {'name': '', 'content': d, 'msg_type': 'other'}
+                msg = cls.parse_packet(op, body)
+            except Exception:
+                continue
+            if msg is not None:
                 msgs.append(msg)
-            except:
-                pass
         return msgs
 
+    @classmethod
+    def parse_packet(cls, op, body: memoryview) -> Optional[DanmuMessage]:
+        if op == cls.TYPE_HEARTBEAT_REPLY:
+            # 心跳回复包体为 4 字节人气值
+            return DanmuMessage(cls.TYPE_POPULARITY, int.from_bytes(body[:4], 'big'))
+        if op != cls.TYPE_MESSAGE:
+            return DanmuMessage(cls.TYPE_OTHER, bytes(body), name='')
+        return cls.commands.dispatch(loads(body))
+
     @staticmethod
     def encode_payload(data, type_=TYPE_HEARTBEAT):
-        payload = json.dumps(data, separators=(',', ':')).encode('ascii')
-        payload_length = len(payload) + 16
-        data = payload_length.to_bytes(4, byteorder='big')
-        data += (16).to_bytes(2, byteorder='big')
-        data += (1).to_bytes(2, byteorder='big')
-        data += type_.to_bytes(4, byteorder='big')
-        data += (1).to_bytes(4, byteorder='big')
-        data += payload
-        return data
+        return encode_packet(dumps(data), type_)
 
     async def send_heatbeat(self):
-        LogManager.instance().debug('[WebSocket] 正在发送维持心跳包')
-        await self.ws.send_bytes(self.encode_payload('[object Object]'))
+        await self.heartbeat.beat()
+
+    def host_urls(self, token_data: DanmuKeyData) -> List[str]:
+        """
+        弹幕服务器地址列表, 优先使用 getDanmuInfo 返回的 host_list
+        """
+        urls = []
+        for host in token_data.host_list:
+            port = host.wss_port if self.DANMU_WS_SCHEME == 'wss' else host.ws_port
+            urls.append(f'{self.DANMU_WS_SCHEME}://{host.host}:{port}/sub')
+        return urls or [self.DANMU_WS]
 
+    @single_flight
     async def room_init(self, roomid) -> RoomInitData:
-        room_init_uri = f'https://{self.LIVE_API_HOST}/room/v1/Room/room_init'
+        room_init_uri = f'{self.LIVE_API_URL}/room/v1/Room/room_init'
         room_init_params = {'id': roomid}
         async with self.session.get(room_init_uri, params=room_init_params) as r:
-            res = RoomInitResponse(**(await r.json()))
+            res = RoomInitResponse(**(await r.json(loads=loads)))
             if res.code != 0:
                 raise BilibiliServiceException(res.message, res.code)
         return res.data
 
-    async def ws_connect(self, roomid):
-        loop = asyncio.get_event_loop()
-        if self.ws and not self.ws.closed:
-            return
+    async def ws_connect(self, roomid, record=None):
+        """
+        连接直播间弹幕并持续接收, 断线自动重连, 直到连接被主动关闭; 该直播间已连接时直接返回.
+        需先订阅该直播间, 没有订阅者 (如已取消订阅) 时不建立连接
+        :param roomid: 直播间号 (可为短号)
+        :param record: 录制文件, 指定时将收到的原始帧追加写入该文件
+        """
         room_init_data = await self.room_init(roomid)
-        token_data = await self.get_danmu_key(room_init_data.room_id)
-        async with self.session.ws_connect(self.DANMU_WS) as ws:
-            self.ws = ws
-            payload = {'uid': int(1e14 + 2e14 * random()), 'roomid': room_init_data.room_id, 'protover': 1,
-                       'platform': 'web', 'clientver': '1.14.1', 'type': 2, 'key': token_data.token}
-            await ws.send_bytes(self.encode_payload(payload, type_=self.TYPE_JOIN_ROOM))
-            self.timer = Timer(30, self.send_heatbeat)
-            async for msg in ws:
-                msg: WSMessage
-                if msg.type == WSMsgType.BINARY:
-                    for data in self.decode_msg(msg.data):
-                        danmu = DanmuData(**data)
-                        for cb in self.callbacks.union(self.external_callbacks):
-                            try:
-                                if asyncio.iscoroutinefunction(cb):
-                                    await cb(danmu)
-                                else:
-                                    loop.run_in_executor(None, cb, danmu)
-                            except Exception as err:
-                                LogManager.instance().warning('弹幕分发错误: ' + str(err))
-                else:
-                    LogManager.instance().info('[WebSocket] 接收到未知消息' + msg)
+        roomid = room_init_data.room_id
+        connection = self.connections.get(roomid)
+        if connection is None or connection.stopping or not connection.retained:
+            LogManager.instance().debug(f'[WebSocket] 直播间 {roomid} 没有订阅者, 不建立连接')
+            return
+        if record is not None:
+            connection.record(record)
+        if connection.task is not None and not connection.task.done():
+            return
+        connection.task = asyncio.ensure_future(connection.supervise())
+        try:
+            await connection.task
+        except asyncio.CancelledError:
+            # 被 close 取消时正常返回
+            if not connection.stopping:
+                raise
+        finally:
+            connection.stop_recording()
+            if self.connections.get(roomid) is connection and not connection.subscribers:
+                self.connections.pop(roomid)
 
 
 async def main():
     print(await BilibiliLiveService().roomid)
-    await BilibiliLiveService().session.close()
+    await BilibiliLiveService().close()
+    await ConnectorManager().close()
 
 
 if __name__ == '__main__':
@@ -73,15 +73,35 @@ def create_obs_configuration(rtmp, key, profile='BilibiliLive'):
 
 
 class Timer:
+    """
+    周期定时器
+
+    按固定节拍循环执行回调, 回调耗时不会累积漂移; 回调耗时超过一个周期时跳过错过的节拍
+    """
+
     def __init__(self, timeout, callback):
         self._timeout = timeout
         self._callback = callback
         self._task = asyncio.ensure_future(self._job())
 
     async def _job(self):
-        await asyncio.sleep(self._timeout)
-        await self._callback()
-        await self._job()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while True:
+            deadline += self._timeout
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            try:
+                await self._callback()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                LogManager.instance().warning(f'[Timer] 定时任务执行异常 {err}')
+            if loop.time() - deadline > self._timeout:
+                deadline = loop.time()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._task.done()
 
     def cancel(self):
         self._task.cancel()
@@ -1,21 +1,30 @@
 import asyncio
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Optional
 
-from PySide6.QtCore import QSize, Qt
-from PySide6.QtGui import QMouseEvent
-from PySide6.QtWidgets import QDialog, QVBoxLayout, QTabWidget, QFrame, QGridLayout, QSizePolicy
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QTabWidget, QFrame, QGridLayout, QSizePolicy, \
+    QLineEdit, QListWidget, QListWidgetItem
 
-from open_bilibili_link.models import LiveAreaResponse, LiveAreaHistoryResponse
+from open_bilibili_link.areas import AreaIndex
+from open_bilibili_link.models import LiveAreaHistoryResponse
 from open_bilibili_link.services import BilibiliLiveService
 from open_bilibili_link.widgets.components.label import QClickableLabel
 
 
 class AreaSelector(QDialog):
+    """
+    分区选择对话框
+
+    只构建当前显示的标签页, 其余标签页在首次切换时构建; 同一实例可重复打开,
+    分区数据未变化时不重建标签页. 搜索框支持分区名/拼音的前缀和模糊匹配
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.area_data: List[LiveAreaResponse.LiveAreaCategory] = []
+        self.index: Optional[AreaIndex] = None
         self.history: List[LiveAreaHistoryResponse.HistoryLiveArea] = []
+        self.history_areas: Dict[int, LiveAreaHistoryResponse.HistoryLiveArea] = {}
         self.setup_ui()
 
     def setup_ui(self):
@@ -25,51 +34,112 @@ class AreaSelector(QDialog):
         self.setFixedWidth(600)
         self.setFixedHeight(360)
         main_layout = QVBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText('搜索分区 (名称/拼音)')
+        self.search_input.setClearButtonEnabled(True)
+        self.search_result = QListWidget()
+        self.search_result.hide()
         self.tab_widget = QTabWidget()
-        self.cate_tabs: List[QFrame] = []
-        self.areas_list: List[dict] = []
+        # 标签页 -> 该页的分区列表, 构建后移除
+        self.pending_tabs: Dict[QFrame, list] = {}
+        main_layout.addWidget(self.search_input)
+        main_layout.addWidget(self.search_result)
         main_layout.addWidget(self.tab_widget)
         self.setLayout(main_layout)
+        self.tab_widget.currentChanged.connect(self.build_current_tab)
+        self.search_input.textChanged.connect(self.search)
+        self.search_input.returnPressed.connect(self.select_first_result)
+        self.search_result.itemClicked.connect(self.select_result)
 
     def show_data(self):
+        self.search_input.clear()
         asyncio.gather(self.load_info())
 
     async def load_info(self):
         if BilibiliLiveService().logged_in:
-            self.history = await BilibiliLiveService().get_history_areas()
-            self.area_data = await BilibiliLiveService().get_live_areas()
-            self.cate_tabs.append(QFrame())
-            self.tab_widget.addTab(self.cate_tabs[-1], '常用')
-            self.init_tab(self.cate_tabs[-1], self.history)
-            for category in self.area_data:
-                self.cate_tabs.append(QFrame())
-                self.tab_widget.addTab(self.cate_tabs[-1], category.name)
-                self.init_tab(self.cate_tabs[-1], category.list)
+            history, index = await asyncio.gather(BilibiliLiveService().get_history_areas(),
+                                                  BilibiliLiveService().get_area_index())
+            # 接口缓存命中时返回同一对象, 数据未变化则保留已构建的标签页
+            history_changed = history is not self.history
+            self.history = history
+            self.history_areas = {area.id: area for area in history}
+            if index is not self.index:
+                self.index = index
+                self.reset_tabs()
+            elif history_changed:
+                self.replace_history_tab()
+            self.build_current_tab()
+
+    def add_tab(self, name: str, areas: list, index: int = -1):
+        tab = QFrame()
+        self.pending_tabs[tab] = areas
+        self.tab_widget.insertTab(index, tab, name)
+
+    def reset_tabs(self):
+        self.tab_widget.blockSignals(True)
+        while self.tab_widget.count():
+            tab = self.tab_widget.widget(0)
+            self.tab_widget.removeTab(0)
+            tab.deleteLater()
+        self.pending_tabs.clear()
+        self.add_tab('常用', self.history)
+        for category in self.index.categories:
+            self.add_tab(category.name, category.list)
+        self.tab_widget.blockSignals(False)
+
+    def replace_history_tab(self):
+        self.tab_widget.blockSignals(True)
+        current = self.tab_widget.currentIndex()
+        tab = self.tab_widget.widget(0)
+        self.tab_widget.removeTab(0)
+        self.pending_tabs.pop(tab, None)
+        tab.deleteLater()
+        self.add_tab('常用', self.history, 0)
+        self.tab_widget.setCurrentIndex(current)
+        self.tab_widget.blockSignals(False)
+
+    def build_current_tab(self, *_):
+        tab = self.tab_widget.currentWidget()
+        if tab in self.pending_tabs:
+            self.init_tab(tab, self.pending_tabs.pop(tab))
 
     def init_tab(self, tab, areas):
         layout = QGridLayout()
         layout.setAlignment(Qt.AlignTop)
         for i, area in enumerate(areas):
             area_label = QClickableLabel(area.name)
+            area_label.setProperty('area_id', area.id)
             area_label.setMinimumWidth(100)
             area_label.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
             area_label.clicked.connect(self.select_area)
             layout.addWidget(area_label, i // 6, i % 6)
         tab.setLayout(layout)
 
+    def search(self, text: str):
+        self.search_result.clear()
+        areas = self.index.search(text) if self.index is not None else []
+        for area in areas:
+            item = QListWidgetItem(f'{area.parent_name}/{area.name}')
+            item.setData(Qt.UserRole, area.id)
+            self.search_result.addItem(item)
+        self.search_result.setVisible(bool(text.strip()))
+        self.tab_widget.setVisible(not text.strip())
+
+    def select_result(self, item: QListWidgetItem):
+        self.change_area(item.data(Qt.UserRole))
+
+    def select_first_result(self):
+        if self.search_result.count():
+            self.select_result(self.search_result.item(0))
+
     def select_area(self, _, target: QClickableLabel):
-        if self.tab_widget.currentIndex() == 0:
-            for area in self.history:
-                if area.name == target.text():
-                    BilibiliLiveService().areaid = area.id
-                    asyncio.gather(BilibiliLiveService().update_room(area_id=area.id))
-                    self.parent().label_area_content.setText(f'{area.parent_name}/{area.name}')
-                    self.close()
+        self.change_area(target.property('area_id'))
+
+    def change_area(self, areaid: int):
+        area = self.index.get(areaid) or self.history_areas.get(areaid)
+        if area is None:
             return
-        category = self.area_data[self.tab_widget.currentIndex() - 1]
-        for area in category.list:
-            if area.name == target.text():
-                BilibiliLiveService().areaid = area.id
-                self.parent().label_area_content.setText(f'{area.parent_name}/{area.name}')
-                asyncio.gather(BilibiliLiveService().update_room(area_id=area.id))
-                self.close()
+        BilibiliLiveService().areaid = area.id
+        self.parent().label_area_content.setText(f'{area.parent_name}/{area.name}')
+        asyncio.gather(BilibiliLiveService().update_room(area_id=area.id))
+        self.close()
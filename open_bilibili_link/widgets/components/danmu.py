@@ -1,39 +1,42 @@
 import asyncio
+import os
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from threading import Lock
+from typing import Optional, Union, List, Dict, Tuple
 
-from PySide6.QtCore import Qt, QSize, QModelIndex
-from PySide6.QtGui import QStandardItemModel, QStandardItem, QFontMetrics
+from PySide6.QtCore import Qt, QSize, QModelIndex, QAbstractListModel, QTimer
+from PySide6.QtGui import QFontMetrics
 from PySide6.QtWidgets import QDockWidget, QVBoxLayout, QListView, QScrollArea, QStyledItemDelegate, QStyleOptionViewItem, \
     QFrame, QLineEdit, QPushButton
+from pydantic import BaseModel
 from qasync import asyncSlot
 
 from open_bilibili_link.logger import LogManager
-from open_bilibili_link.models import DanmuData
+from open_bilibili_link.models import DanmuMessage, DanmuData
 from open_bilibili_link.services import BilibiliLiveDanmuService, BilibiliLiveService
 from open_bilibili_link.widgets.components.toast import Toast
 
 
 class DanmuParser:
     @staticmethod
-    def parse(danmu: DanmuData) -> Optional[str]:
+    def parse(danmu: DanmuMessage) -> Optional[str]:
         if danmu.msg_type == BilibiliLiveDanmuService.TYPE_DANMUKU:
             return f'{danmu.name}: {danmu.content}'
         elif danmu.msg_type == BilibiliLiveDanmuService.TYPE_GIFT:
-            return f'{danmu.content.data.uname} {danmu.content.data.action} {danmu.content.data.gift_name} ' \
-                   f'x{danmu.content.data.num}'
+            data = DanmuParser.content_data(danmu)
+            return f'{data.get("uname")} {data.get("action")} {data.get("giftName")} x{data.get("num")}'
         elif danmu.msg_type == BilibiliLiveDanmuService.TYPE_ENTER:
+            data = DanmuParser.content_data(danmu)
             vip_text = ''
-            if hasattr(danmu.content.data, 'vip') and danmu.content.data.vip:
+            if data.get('vip'):
                 vip_text += '[VIP] '
-            if hasattr(danmu.content.data, 'svip') and danmu.content.data.svip:
+            if data.get('svip'):
                 vip_text += '[SVIP] '
-            uname = ''
-            if hasattr(danmu.content.data, 'uname'):
-                uname = danmu.content.data.uname
-            return f'{vip_text}{uname} 进入房间'
+            return f'{vip_text}{data.get("uname", "")} 进入房间'
         elif danmu.msg_type == BilibiliLiveDanmuService.TYPE_BROADCAST:
             LogManager.instance().info('[WebSocket] 接收到广播消息 ' + danmu.content)
+            return None
         elif danmu.msg_type == BilibiliLiveDanmuService.TYPE_OTHER:
             if isinstance(danmu.content, str) or isinstance(danmu.content, bytes):
                 return None
@@ -42,40 +45,199 @@ class DanmuParser:
         LogManager.instance().info(f'[WebSocket] 未知消息类型 {danmu.msg_type}')
         return None
 
+    @staticmethod
+    def content_data(danmu: Union[DanmuMessage, DanmuData]) -> dict:
+        """
+        获取消息 content.data 字典, 兼容未校验的 DanmuMessage 和校验后的 DanmuData
+        """
+        content = danmu.content
+        if isinstance(content, dict):
+            return content.get('data') or {}
+        data = getattr(content, 'data', None)
+        if isinstance(data, BaseModel):
+            return data.model_dump(by_alias=True)
+        return data if isinstance(data, dict) else {}
+
     @staticmethod
     def parse_cmd(_) -> Optional[str]:
         return None
 
 
 class DanmuPusher:
+    """
+    弹幕文本推送, 可作为 OBS 文本源
+
+    默认持续追加写入; 指定 max_lines 时只保留最近 max_lines 行,
+    以临时文件 + 重命名的方式整体替换文件, 且每 refresh_interval 秒最多写入一次
+    """
     CACHE_DIR = Path.home() / '.cache/OBL'
+    DEFAULT_MAX_LINES = 20
+    DEFAULT_REFRESH_INTERVAL = 0.5
 
-    def __init__(self, roomid):
+    def __init__(self, roomid, max_lines: Optional[int] = None,
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
         self.roomid = roomid
         if not self.CACHE_DIR.exists():
             self.CACHE_DIR.mkdir(parents=True)
         self.target = self.CACHE_DIR / f'{roomid}.txt'
         self.target.unlink(missing_ok=True)
-        self.file = self.target.open('a')
+        self.max_lines = max_lines
+        self.refresh_interval = refresh_interval
+        self.file = None
+        self.lines: Optional[deque] = None
+        if max_lines:
+            self.lines = deque(maxlen=max_lines)
+            self.target.touch()
+        else:
+            self.file = self.target.open('a')
+        # 回调可能在线程池中执行, 写入调度统一交给事件循环
+        self._loop = asyncio.get_event_loop()
+        self._lock = Lock()
+        self._dirty = False
+        self._last_write = 0.0
+        self._pending: Optional[asyncio.TimerHandle] = None
+
+    def append_danmu(self, danmu: DanmuMessage):
+        self.append_danmus([danmu])
+
+    def append_danmus(self, danmus: List[DanmuMessage]):
+        self.append_lines([text + '\n' for text in map(DanmuParser.parse, danmus) if text is not None])
+
+    def append_lines(self, lines: List[str]):
+        if not lines:
+            return
+        if self.lines is None:
+            self.file.writelines(lines)
+            self.file.flush()
+            return
+        with self._lock:
+            self.lines.extend(lines)
+            if self._dirty:
+                return
+            self._dirty = True
+        self._loop.call_soon_threadsafe(self._schedule)
+
+    def _schedule(self):
+        if self._pending is not None:
+            return
+        delay = self._last_write + self.refresh_interval - self._loop.time()
+        if delay > 0:
+            self._pending = self._loop.call_later(delay, self.flush)
+        else:
+            self.flush()
 
-    def append_danmu(self, danmu: DanmuData):
-        text = DanmuParser.parse(danmu)
-        if text is not None:
-            self.file.write(text + '\n')
+    def flush(self):
+        """
+        立即写入缓冲区中的行
+        """
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self.lines is None:
             self.file.flush()
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            text = ''.join(self.lines)
+        self._last_write = self._loop.time()
+        tmp = self.target.with_name(f'{self.target.name}.tmp')
+        try:
+            tmp.write_text(text, encoding='utf-8')
+            os.replace(tmp, self.target)
+        except OSError as err:
+            # Windows 下目标文件被占用时替换会失败, 下个周期重试
+            LogManager.instance().warning(f'[Pusher] 写入弹幕文件失败 {err}')
+            with self._lock:
+                self._dirty = True
+            self._pending = self._loop.call_later(self.refresh_interval, self.flush)
 
     def close(self):
-        self.file.flush()
-        self.file.close()
+        self.flush()
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class DanmuListModel(QAbstractListModel):
+    """
+    弹幕列表模型
+
+    固定容量的环形缓冲区, 超出容量时从头部移除最旧的行; 追加按批插入
+    """
+    DEFAULT_CAPACITY = 1000
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, parent=None):
+        super().__init__(parent)
+        self.capacity = capacity
+        self._buffer: List[Optional[str]] = [None] * capacity
+        self._start = 0
+        self._count = 0
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._count
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole or not 0 <= index.row() < self._count:
+            return None
+        return self._buffer[(self._start + index.row()) % self.capacity]
+
+    def append_texts(self, texts: List[str]):
+        """
+        批量追加行
+        :param texts: 文本列表
+        :type texts: List[str]
+        """
+        if not texts:
+            return
+        texts = texts[-self.capacity:]
+        overflow = self._count + len(texts) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for i in range(overflow):
+                self._buffer[(self._start + i) % self.capacity] = None
+            self._start = (self._start + overflow) % self.capacity
+            self._count -= overflow
+            self.endRemoveRows()
+        self.beginInsertRows(QModelIndex(), self._count, self._count + len(texts) - 1)
+        for text in texts:
+            self._buffer[(self._start + self._count) % self.capacity] = text
+            self._count += 1
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self._buffer = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+        self.endResetModel()
 
 
 class DanmuItemDelegate(QStyledItemDelegate):
+    """
+    弹幕行委托, 按 (文本, 宽度) 缓存行高, 避免每次布局都重新计算换行
+    """
+    CACHE_SIZE = 4000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._heights: Dict[Tuple[str, int, str], int] = {}
+
     def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
-        fm = QFontMetrics(option.font)
-        model = index.model()
-        text = str(model.data(index, Qt.DisplayRole))
-        rect = fm.boundingRect(option.rect, Qt.TextWordWrap, text)
-        return QSize(option.rect.width(), rect.height() + 6)
+        text = str(index.model().data(index, Qt.DisplayRole))
+        width = option.rect.width()
+        key = (text, width, option.font.key())
+        height = self._heights.get(key)
+        if height is None:
+            if len(self._heights) >= self.CACHE_SIZE:
+                self._heights.clear()
+            fm = QFontMetrics(option.font)
+            height = self._heights[key] = fm.boundingRect(option.rect, Qt.TextWordWrap, text).height() + 6
+        return QSize(width, height)
 
 
 class DanmuWidget(QDockWidget):
@@ -107,10 +269,12 @@ class DanmuWidget(QDockWidget):
         self.danmu_list_view = QListView()
         self.danmu_list_view.setContentsMargins(0, 0, 0, 0)
         self.danmu_list_view.setWordWrap(True)
+        self.danmu_list_view.setLayoutMode(QListView.Batched)
         self.danmu_list_view.setItemDelegate(DanmuItemDelegate(self))
         self.danmu_list_view.setStyleSheet('QListView { background: skyblue; font-size: 13px; }')
-        self.danmu_list_model = QStandardItemModel()
+        self.danmu_list_model = DanmuListModel(parent=self)
         self.danmu_list_view.setModel(self.danmu_list_model)
+        self._scroll_pending = False
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         layout.addWidget(self.danmu_list_view)
@@ -136,23 +300,36 @@ class DanmuWidget(QDockWidget):
             asyncio.gather(self.load_history())
             self.load_danmu()
 
-    def append_danmu(self, danmu: DanmuData):
-        text = DanmuParser.parse(danmu)
-        if text is not None:
-            self.danmu_list_model.appendRow([QStandardItem(text)])
-            self.danmu_list_view.scrollToBottom()
+    def append_danmu(self, danmu: DanmuMessage):
+        self.append_danmus([danmu])
+
+    def append_danmus(self, danmus: List[DanmuMessage]):
+        self.append_texts([text for text in map(DanmuParser.parse, danmus) if text is not None])
+
+    def append_texts(self, texts: List[str]):
+        if not texts:
+            return
+        scrollbar = self.danmu_list_view.verticalScrollBar()
+        # 仅在已处于底部时跟随滚动, 一个事件循环周期内最多滚动一次
+        follow = scrollbar.value() >= scrollbar.maximum()
+        self.danmu_list_model.append_texts(texts)
+        if follow and not self._scroll_pending:
+            self._scroll_pending = True
+            QTimer.singleShot(0, self._scroll_to_bottom)
+
+    def _scroll_to_bottom(self):
+        self._scroll_pending = False
+        self.danmu_list_view.scrollToBottom()
 
     def closeEvent(self, _):
-        BilibiliLiveDanmuService().unregister_callback(self.append_danmu)
+        BilibiliLiveDanmuService().unsubscribe(self.append_danmus)
         if self.toggle_btn:
             self.toggle_btn.setChecked(False)
 
     async def load_history(self):
         danmus = await BilibiliLiveService().get_danmu_history(self.roomid)
-        for danmu in danmus:
-            self.danmu_list_model.appendRow([QStandardItem(f'{danmu.nickname}: {danmu.text}')])
-            self.danmu_list_view.scrollToBottom()
+        self.append_texts([f'{danmu.nickname}: {danmu.text}' for danmu in danmus])
 
     def load_danmu(self):
-        BilibiliLiveDanmuService().register_callback(self.append_danmu, external=False)
-        asyncio.gather(BilibiliLiveDanmuService().ws_connect(self.roomid))
+        asyncio.gather(BilibiliLiveDanmuService().subscribe(self.roomid, self.append_danmus, batch=True,
+                                                            threaded=False))
@@ -9,7 +9,6 @@ from PySide6.QtWidgets import QVBoxLayout, QLabel, QLineEdit, QDialog, QSizePoli
 from qasync import asyncSlot, asyncClose
 
 from open_bilibili_link.services import BilibiliLiveService, BilibiliServiceException
-from open_bilibili_link.utils import save_cookie
 from open_bilibili_link.widgets.components.label import QClickableLabel
 from open_bilibili_link.widgets.components.toast import Toast
 
@@ -94,7 +93,7 @@ class LoginPanel(QDialog):
                 return
             try:
                 if cookie != '':
-                    save_cookie(cookie, BilibiliLiveService.COOKIE_FILE, '.live.bilibili.com')
+                    await BilibiliLiveService().cookie_login(cookie)
                 else:
                     await BilibiliLiveService().login(username, password)
                 self.parent().login_complete.emit()
@@ -4,6 +4,7 @@ from PySide6.QtWidgets import QFrame, QGridLayout, QLabel, QLineEdit, QPushButto
 from qasync import asyncSlot
 
 from open_bilibili_link.config import ConfigManager
+from open_bilibili_link.loader import SectionLoader
 from open_bilibili_link.services import BilibiliLiveService, BilibiliServiceException, BilibiliLiveDanmuService
 from open_bilibili_link.utils import create_obs_configuration, check_exists, run_command, ping
 from open_bilibili_link.widgets.components.button import CopyButton
@@ -106,14 +107,21 @@ class LiveControlCenter(QFrame):
 
     def launch_danmu_txt(self):
         if self.danmu_pusher is None:
-            self.danmu_pusher = DanmuPusher(self.roomid)
+            # ConfigManager.get 对 0 也返回默认值, 这里需要区分 0 (持续追加) 和未配置
+            live_config = ConfigManager().get('live', default={})
+            max_lines = live_config.get('danmu_max_lines')
+            refresh_interval = live_config.get('danmu_refresh_interval')
+            self.danmu_pusher = DanmuPusher(
+                self.roomid,
+                max_lines=DanmuPusher.DEFAULT_MAX_LINES if max_lines is None else max_lines,
+                refresh_interval=DanmuPusher.DEFAULT_REFRESH_INTERVAL if refresh_interval is None else refresh_interval)
             clipboard = QApplication.clipboard()
             clipboard.setText(self.danmu_pusher.target.as_posix())
             Toast.toast(self, '已复制文件路径，可作为 OBS 文本源')
-            BilibiliLiveDanmuService().register_callback(self.danmu_pusher.append_danmu, external=False)
-            asyncio.gather(BilibiliLiveDanmuService().ws_connect(self.roomid))
+            asyncio.gather(BilibiliLiveDanmuService().subscribe(self.roomid, self.danmu_pusher.append_danmus,
+                                                                batch=True))
         else:
-            BilibiliLiveDanmuService().unregister_callback(self.danmu_pusher.append_danmu)
+            BilibiliLiveDanmuService().unsubscribe(self.danmu_pusher.append_danmus)
             self.danmu_pusher.close()
             self.danmu_pusher = None
 
@@ -162,9 +170,7 @@ class LiveControlCenter(QFrame):
             await BilibiliLiveService().stop_live()
         else:
             await BilibiliLiveService().start_live()
-        BilibiliLiveService().live_status = None
-        await self.homepage.usercard.load_info()
-        await self.load_info()
+        await asyncio.gather(self.homepage.usercard.load_info(), self.load_info())
 
     @asyncSlot()
     async def onekey_live(self):
@@ -193,15 +199,34 @@ class LiveControlCenter(QFrame):
 
     async def load_info(self):
         if BilibiliLiveService().logged_in:
-            live_status = await BilibiliLiveService().live_status
-            self.roomid = await BilibiliLiveService().roomid
-            self.set_live_code(await BilibiliLiveService().get_live_code())
-            self.toggle_live_button.setText('关闭直播' if live_status else '开启直播')
-            self.toggle_live_button.setChecked(live_status)
-            self.toggle_onekey_live.setChecked(live_status)
-            check_info = await BilibiliLiveService().check_info()
-            self.sign_in_btn.setText('已签到' if check_info.status else '签到')
-            self.sign_in_btn.setChecked(check_info.status)
-            auto_sign = ConfigManager().get('live', 'autosign')
-            if auto_sign and not check_info.status:
-                self.sign_in_btn.click()
+            loader = SectionLoader('LiveControlCenter')
+            live_status = loader.fetch('live_status', BilibiliLiveService().live_status)
+            roomid = loader.fetch('roomid', BilibiliLiveService().roomid)
+            live_code = loader.fetch('live_code', BilibiliLiveService().get_live_code())
+            check_info = loader.fetch('check_info', BilibiliLiveService().check_info())
+
+            async def status():
+                status = await live_status
+                self.toggle_live_button.setText('关闭直播' if status else '开启直播')
+                self.toggle_live_button.setChecked(status)
+                self.toggle_onekey_live.setChecked(status)
+
+            async def room():
+                self.roomid = await roomid
+
+            async def code():
+                self.set_live_code(await live_code)
+
+            async def checkin():
+                info = await check_info
+                self.sign_in_btn.setText('已签到' if info.status else '签到')
+                self.sign_in_btn.setChecked(info.status)
+                auto_sign = ConfigManager().get('live', 'autosign')
+                if auto_sign and not info.status:
+                    self.sign_in_btn.click()
+
+            loader.section('status', status())
+            loader.section('room', room())
+            loader.section('code', code())
+            loader.section('checkin', checkin())
+            await loader.wait()
@@ -3,16 +3,18 @@ from datetime import timezone
 from pprint import pprint
 from typing import Optional
 
-from PySide6.QtCore import Qt, Signal as pyqtSignal
+from PySide6.QtCore import Qt, QTimer, Signal as pyqtSignal
 from PySide6.QtGui import QPixmap, QPainter
 from PySide6.QtWidgets import QFrame, QHBoxLayout, QSizePolicy, QVBoxLayout, QGridLayout, QLabel, QPushButton, \
     QLineEdit
 from qasync import asyncSlot
 
+from open_bilibili_link.loader import SectionLoader
 from open_bilibili_link.services import BilibiliLiveService
 from open_bilibili_link.widgets.components.areas import AreaSelector
 from open_bilibili_link.widgets.components.dialog import LoginPanel
 from open_bilibili_link.widgets.components.label import QClickableLabel, KeyframeLabel
+from open_bilibili_link.widgets.pixmaps import PixmapCache, ScaleMode
 
 
 class UserCardMain(QFrame):
@@ -68,10 +70,10 @@ class UserCardMain(QFrame):
         self.label_birth.setText(
             f'Birth: {userinfo.birthday.replace(tzinfo=timezone.utc).astimezone(tz=None).strftime("%Y-%m-%d")}')
 
-    def set_avatar(self, avatar):
-        pixmap = QPixmap()
-        pixmap.loadFromData(avatar)
-        self.avatar.setPixmap(pixmap.scaledToWidth(self.avatar.width(), Qt.SmoothTransformation))
+    async def set_avatar(self, user_info):
+        self.avatar.setPixmap(await PixmapCache().get(
+            user_info.face, lambda: BilibiliLiveService().get_cached_face(user_info), self.avatar.width(),
+            mode=ScaleMode.fit_width, ratio=self.devicePixelRatioF()))
 
     @asyncSlot()
     async def show_login(self):
@@ -83,6 +85,7 @@ class UserCardMain(QFrame):
 class UserCardLive(QFrame):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.area_selector: Optional[AreaSelector] = None
         self.setup_ui()
         self.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
 
@@ -148,9 +151,10 @@ class UserCardLive(QFrame):
         self.label_area_edit.clicked.connect(self.label_area_edit_clicked)
 
     def label_area_edit_clicked(self):
-        selector = AreaSelector(self)
-        selector.show_data()
-        selector.exec()
+        if self.area_selector is None:
+            self.area_selector = AreaSelector(self)
+        self.area_selector.show_data()
+        self.area_selector.exec()
 
     @asyncSlot()
     async def label_title_edit_clicked(self):
@@ -165,18 +169,21 @@ class UserCardLive(QFrame):
             self.label_title_content.setReadOnly(True)
             self.label_title_edit.setEnabled(True)
 
-    async def set_room_info(self, room_info, news):
+    def set_room_info(self, room_info):
         self.label_roomid.setText(
             f'房间号: {room_info.room_id} <a href="https://live.bilibili.com/{room_info.room_id}">Go</a>')
         self.label_title_content.setText(f'{room_info.title}')
         self.label_tags.setText(f'个人标签：{room_info.tags}')
-        self.label_news.setText(f'直播公告：{news.content}')
         self.label_desc.setText(f'个人简介: {room_info.description}')
         self.label_area_content.setText(f'{room_info.parent_area_name}/{room_info.area_name}')
-        pixmap = QPixmap()
-        pixmap.loadFromData(await BilibiliLiveService.get_image(room_info.keyframe))
-        self.label_keyframe.setPixmap(pixmap.scaled(self.label_keyframe.width(), self.label_keyframe.height(),
-                                                    Qt.KeepAspectRatioByExpanding))
+
+    def set_news(self, news):
+        self.label_news.setText(f'直播公告：{news.content}')
+
+    async def set_keyframe(self, room_info):
+        self.label_keyframe.setPixmap(await PixmapCache().get(
+            room_info.keyframe, lambda: BilibiliLiveService().get_image(room_info.keyframe),
+            self.label_keyframe.width(), self.label_keyframe.height(), ratio=self.devicePixelRatioF()))
         self.label_keyframe.show()
         self.label_keyframe.live_status_text = '直播中' if room_info.live_status else '未开播'
         self.label_keyframe.live_online = room_info.online
@@ -184,10 +191,19 @@ class UserCardLive(QFrame):
 
 
 class UserCard(QFrame):
+    # 调整大小后重新生成背景的延迟 (毫秒)
+    RESIZE_DEBOUNCE = 150
+
     def __init__(self):
         super().__init__()
         self.setup_ui()
         self.background_image: Optional[QPixmap] = None
+        self.background_room = None
+        # 拖动调整窗口大小时只在停止后按最终尺寸重新生成背景
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(self.RESIZE_DEBOUNCE)
+        self.resize_timer.timeout.connect(self.reload_background)
 
     def setup_ui(self):
         self.setFixedHeight(280)
@@ -207,17 +223,29 @@ class UserCard(QFrame):
 
     def paintEvent(self, _):
         if self.background_image:
+            # 背景已按控件尺寸缩放裁剪, 直接绘制
             painter = QPainter(self)
-            self.background_image.scaled(self.width(), self.height(), Qt.KeepAspectRatioByExpanding)
-            self.background_image.rect().moveCenter(self.rect().center())
-            painter.drawPixmap(self.background_image.rect().topLeft(), self.background_image)
+            painter.drawPixmap(0, 0, self.background_image)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.background_room is not None and event.size() != event.oldSize():
+            self.resize_timer.start()
+
+    @asyncSlot()
+    async def reload_background(self):
+        if self.background_room is not None:
+            await self.set_background(self.background_room)
 
-    def set_background(self, data):
-        pixmap = QPixmap()
-        pixmap.loadFromData(data)
-        pixmap = pixmap.scaled(self.width(), self.height(), Qt.KeepAspectRatioByExpanding)
-        self.background_image = pixmap
-        self.repaint()
+    async def set_background(self, room):
+        self.background_room = room
+        width, height = self.width(), self.height()
+        pixmap = await PixmapCache().get(room.background, lambda: BilibiliLiveService().get_cached_background(room),
+                                         width, height, ratio=self.devicePixelRatioF())
+        # 等待期间尺寸已变化时, 由 resize_timer 发起的请求负责更新
+        if (width, height) == (self.width(), self.height()):
+            self.background_image = pixmap
+            self.update()
 
     async def load_info(self):
         if BilibiliLiveService().logged_in:
@@ -226,11 +254,34 @@ class UserCard(QFrame):
             self.right_card.label_area.setText('分区信息:   ')
             self.right_card.label_title_edit.show()
             self.right_card.label_area_edit.show()
-            user_info = await BilibiliLiveService().get_user_info()
-            room = await BilibiliLiveService().get_room_info()
-            news = await BilibiliLiveService().get_live_news()
-            self.main_card.set_user_info(user_info)
-            # self.right_card.set_live_info(await BilibiliLiveService().live_info())
-            await self.right_card.set_room_info(room, news)
-            self.main_card.set_avatar(await BilibiliLiveService().get_cached_face(user_info))
-            self.set_background(await BilibiliLiveService().get_cached_background(room))
+            # 三个接口同时请求, 各区块在所需数据到达后立即渲染
+            loader = SectionLoader('UserCard')
+            user_info = loader.fetch('user_info', BilibiliLiveService().get_user_info())
+            room = loader.fetch('room_info', BilibiliLiveService().get_room_info())
+            news = loader.fetch('live_news', BilibiliLiveService().get_live_news())
+
+            async def user():
+                self.main_card.set_user_info(await user_info)
+
+            async def avatar():
+                await self.main_card.set_avatar(await user_info)
+
+            async def room_info():
+                self.right_card.set_room_info(await room)
+
+            async def live_news():
+                self.right_card.set_news(await news)
+
+            async def keyframe():
+                await self.right_card.set_keyframe(await room)
+
+            async def background():
+                await self.set_background(await room)
+
+            loader.section('user', user())
+            loader.section('avatar', avatar())
+            loader.section('room', room_info())
+            loader.section('news', live_news())
+            loader.section('keyframe', keyframe())
+            loader.section('background', background())
+            await loader.wait()
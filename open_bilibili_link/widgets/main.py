@@ -5,6 +5,7 @@ from PySide6.QtGui import QStandardItemModel, QStandardItem, QIcon
 from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QFrame, QHBoxLayout, QListView, QSizePolicy, QApplication
 from qasync import asyncClose
 
+from open_bilibili_link.network import ConnectorManager
 from open_bilibili_link.services import BilibiliLiveService, BilibiliLiveDanmuService
 from open_bilibili_link.widgets.menu import MenuView, MenuFrame
 from open_bilibili_link.widgets.routes import RouteManager
@@ -29,9 +30,10 @@ class AppMainWindow(QMainWindow):
     @asyncClose
     async def closeEvent(self, event):
         if BilibiliLiveDanmuService().session and not BilibiliLiveDanmuService().session.closed:
-            await BilibiliLiveDanmuService().session.close()
+            await BilibiliLiveDanmuService().close()
         if BilibiliLiveService().session and not BilibiliLiveService().session.closed:
-            await BilibiliLiveService().session.close()
+            await BilibiliLiveService().close()
+        await ConnectorManager().close()
 
     def setup_ui(self):
         # load qss
@@ -0,0 +1,106 @@
+import asyncio
+from collections import OrderedDict
+from enum import Enum
+from typing import Awaitable, Callable, Dict
+
+from PySide6.QtCore import Qt, QRect
+from PySide6.QtGui import QImage, QPixmap
+
+from open_bilibili_link.utils import Singleton
+
+
+class ScaleMode(Enum):
+    """
+    缩放方式
+    """
+    # 按宽度等比缩放
+    fit_width = 'fit-width'
+    # 等比放大铺满并居中裁剪为目标尺寸
+    cover = 'cover'
+
+
+def decode_scaled(data: bytes, width: int, height: int, mode: ScaleMode) -> QImage:
+    """
+    解码并缩放图片, 只使用 QImage, 可在非 GUI 线程执行
+    :param data: 图片数据
+    :param width: 目标宽度 (物理像素)
+    :param height: 目标高度 (物理像素)
+    :param mode: 缩放方式
+    :return: 缩放后的图片, 解码失败时为空图片
+    :rtype: QImage
+    """
+    image = QImage.fromData(data)
+    if image.isNull() or width <= 0:
+        return image
+    if mode == ScaleMode.fit_width:
+        return image.scaledToWidth(width, Qt.SmoothTransformation)
+    image = image.scaled(width, height, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+    return image.copy(QRect((image.width() - width) // 2, (image.height() - height) // 2, width, height))
+
+
+class PixmapCache(metaclass=Singleton):
+    """
+    已缩放图片缓存
+
+    以 (地址, 尺寸, 缩放方式, 设备像素比) 为键, 并记录图片数据版本; 每次获取都先经过 ImageCache
+    (内存层命中时开销很小, 并按各自的 ttl 重新验证), 数据变化时重新解码.
+    解码和缩放在线程池中完成, GUI 线程只做 QImage 到 QPixmap 的转换, 重绘时直接绘制缓存的 QPixmap
+    """
+    DEFAULT_CAPACITY = 64
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._pixmaps: OrderedDict = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+
+    async def get(self, url: str, loader: Callable[[], Awaitable[bytes]], width: int, height: int = 0,
+                  mode: ScaleMode = ScaleMode.cover, ratio: float = 1.0) -> QPixmap:
+        """
+        获取缩放到目标尺寸的 QPixmap
+        :param url: 图片地址, 作为缓存键
+        :param loader: 获取图片数据的协程函数, 如 ImageCache 的包装方法
+        :param width: 目标宽度 (逻辑像素)
+        :param height: 目标高度 (逻辑像素), fit_width 时忽略
+        :param mode: 缩放方式
+        :param ratio: 设备像素比
+        :rtype: QPixmap
+        """
+        key = (url, width, height if mode == ScaleMode.cover else 0, mode, ratio)
+        data = await loader()
+        # bytes 的哈希值计算后缓存在对象上, ImageCache 内存层返回同一对象时不会重复计算
+        version = (len(data), hash(data))
+        cached = self._pixmaps.get(key)
+        if cached is not None and cached[0] == version:
+            self._pixmaps.move_to_end(key)
+            return cached[1]
+        # 同一键同一版本的并发请求共享一次解码
+        pending_key = key + (version,)
+        task = self._pending.get(pending_key)
+        if task is None:
+            task = self._pending[pending_key] = asyncio.ensure_future(self._decode(key, data))
+            task.add_done_callback(lambda t: self._done(pending_key, t))
+        image = await asyncio.shield(task)
+        cached = self._pixmaps.get(key)
+        if cached is None or cached[0] != version:
+            pixmap = QPixmap.fromImage(image)
+            pixmap.setDevicePixelRatio(ratio)
+            cached = self._pixmaps[key] = (version, pixmap)
+            self._pixmaps.move_to_end(key)
+            while len(self._pixmaps) > self.capacity:
+                self._pixmaps.popitem(last=False)
+        return cached[1]
+
+    def _done(self, key, task: asyncio.Future):
+        self._pending.pop(key, None)
+        if not task.cancelled():
+            # 标记异常已读取, 避免所有调用者都取消时输出警告
+            task.exception()
+
+    @staticmethod
+    async def _decode(key, data: bytes) -> QImage:
+        _, width, height, mode, ratio = key
+        return await asyncio.get_event_loop().run_in_executor(
+            None, decode_scaled, data, round(width * ratio), round(height * ratio), mode)
+
+    def clear(self):
+        self._pixmaps.clear()